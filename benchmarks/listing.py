@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+"""
+Cost of listing a large namespace, as done by ls -l.
+
+Lists a namespace of the mock wiki (benchmarks/mockwiki.py) with
+readdir() and stats every entry with getattr(). With the default mount
+options the getattr() calls are answered from the readdir() snapshot,
+entry_timeout=0 disables that and every entry costs a full tree lookup
+(path check, refresh check, index walk) as before.
+
+usage: python benchmarks/listing.py [pages] [rounds]
+       (default 5000 pages in one namespace, 20 rounds)
+"""
+
+import os
+import sys
+import time
+import logging
+import subprocess
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARKS, ".."))
+
+from dokuwikifs import DokuFS, DokuFile
+
+
+def mount(url, **options):
+    fs = DokuFS()
+    fs.url = url
+    fs.username = "bench"
+    fs.password = "bench"
+    for key, value in options.items():
+        setattr(fs, key, value)
+    fs.connect()
+    DokuFile.fs = fs
+    fs.file_class = DokuFile
+
+    lookups = [0]
+    findPageTreeEntry = fs._findPageTreeEntry
+    def countingFind(*args, **kw):
+        lookups[0] += 1
+        return findPageTreeEntry(*args, **kw)
+    fs._findPageTreeEntry = countingFind
+    return fs, lookups
+
+
+def listLong(fs, path):
+    """readdir() and getattr() of every entry, returns the number of entries"""
+    names = [entry.name for entry in fs.readdir(path, 0) if entry.name not in (".", "..")]
+    for name in names:
+        fs.getattr(path.rstrip("/") + "/" + name)
+    return len(names)
+
+
+def measure(fs, lookups, rounds):
+    lookups[0] = 0
+    start = time.time()
+    for i in xrange(rounds):
+        entries = listLong(fs, "/")
+    duration = time.time() - start
+    return entries, duration / rounds, lookups[0] // rounds
+
+
+def main(pages, rounds):
+    logging.basicConfig(level=logging.WARNING)
+    mock = subprocess.Popen([sys.executable, os.path.join(BENCHMARKS, "mockwiki.py"),
+                             "--pages", str(pages), "--namespaces", "0"],
+                            stdout=subprocess.PIPE)
+    port = mock.stdout.readline().strip()
+    url = "http://127.0.0.1:{0}".format(port)
+    try:
+        print "{0:>22} {1:>8} {2:>10} {3:>10} {4:>14}".format(
+            "configuration", "entries", "ms/list", "getattr/s", "lookups/list")
+        for label, options in (("per-entry lookups", {'entry_timeout': 0}),
+                               ("readdir snapshot", {})):
+            fs, lookups = mount(url, **options)
+            listLong(fs, "/") #warm up the tree
+            entries, seconds, perList = measure(fs, lookups, rounds)
+            print "{0:>22} {1:>8} {2:>10.1f} {3:>10.0f} {4:>14}".format(
+                label, entries, seconds * 1000, entries / seconds, perList)
+    finally:
+        mock.terminate()
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 20)
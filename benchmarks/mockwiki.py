@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+"""
+Local stand-in for the XML-RPC interface of a DokuWiki.
+
+Implements the methods used by DokuWikiClient on a synthetic wiki of
+generated pages and attachments, without authentication and ACLs.
+Every HTTP request is delayed by the configured latency, a
+system.multicall pays it once like on a real server.
+
+usage: python benchmarks/mockwiki.py [options]
+       prints the port and serves until it is terminated
+"""
+
+import sys
+import time
+import base64
+import hashlib
+import optparse
+import threading
+import xmlrpclib
+from SocketServer import ThreadingMixIn
+from SimpleXMLRPCServer import SimpleXMLRPCServer, SimpleXMLRPCRequestHandler
+
+NO_CHANGES_FAULT = 321
+
+
+class MockWiki(object):
+    """
+    Pages ns0:ns0:page0, ns1:ns0:page1 ... spread round robin over namespaces nested
+    depth levels deep, plus a start page in every namespace. Page text
+    is generated from the id on demand, only pages written by clients
+    are kept in memory.
+    """
+
+    def __init__(self, pages=1000, pageSize=2000, namespaces=10, depth=2, media=0, mediaSize=10000):
+        self.pageSize = pageSize
+        self.mediaSize = mediaSize
+        self.clock = int(time.time()) - 24*60*60
+        self.pages = dict() #id -> mtime
+        self.texts = dict() #id -> text of written pages
+        self.media = dict() #id -> (data, mtime)
+        self.changes = list() #(mtime, id, media)
+        self.lock = threading.Lock()
+        for i in xrange(pages):
+            namespace = self._namespace(i, namespaces, depth)
+            self.pages[namespace + "page{0}".format(i)] = self.clock
+            while namespace:
+                self.pages[namespace + "start"] = self.clock
+                namespace = namespace[:namespace.rstrip(":").rfind(":") + 1]
+        for i in xrange(media):
+            mediaId = self._namespace(i, namespaces, depth) + "file{0}.bin".format(i)
+            self.media[mediaId] = (self._generate(mediaId, mediaSize), self.clock)
+
+    @staticmethod
+    def _namespace(i, namespaces, depth):
+        if namespaces <= 0:
+            return ""
+        return "".join("ns{0}:".format(i // namespaces ** level % namespaces)
+                       for level in range(depth))
+
+    @staticmethod
+    def _generate(pageId, size):
+        line = "  * {0} {1}\n".format(pageId, hashlib.sha1(pageId).hexdigest())
+        return (line * (size // len(line) + 1))[:size]
+
+    def tick(self):
+        """wiki time of the next change, unique per change"""
+        self.clock = max(self.clock + 1, int(time.time()))
+        return self.clock
+
+    def text(self, pageId):
+        if pageId in self.texts:
+            return self.texts[pageId]
+        if pageId in self.pages:
+            return self._generate(pageId, self.pageSize)
+        return ""
+
+    # XML-RPC methods, names as registered in serve()
+
+    def getVersion(self):
+        return "mockwiki"
+
+    def getRPCVersionSupported(self):
+        return 2
+
+    def getPagelist(self, namespace, options):
+        prefix = namespace.strip(":") + ":" if namespace.strip(":") else ""
+        depth = options.get('depth', 0) #absolute, counted from the wiki root
+        with self.lock:
+            return [{'id': pageId, 'rev': mtime, 'mtime': mtime, 'size': len(self.text(pageId))}
+                    for pageId, mtime in sorted(self.pages.items())
+                    if pageId.startswith(prefix) and not (depth and pageId.count(":") >= depth)]
+
+    def getAllPages(self):
+        with self.lock:
+            return [{'id': pageId, 'perms': 16, 'size': len(self.text(pageId)),
+                     'lastModified': xmlrpclib.DateTime(mtime)}
+                    for pageId, mtime in sorted(self.pages.items())]
+
+    def getPage(self, pageId):
+        with self.lock:
+            return self.text(pageId)
+
+    def getPageVersion(self, pageId, revision):
+        return self.getPage(pageId)
+
+    def getPageVersions(self, pageId, offset):
+        return []
+
+    def getPageInfo(self, pageId):
+        with self.lock:
+            if pageId not in self.pages:
+                raise xmlrpclib.Fault(121, "The requested page does not exist")
+            mtime = self.pages[pageId]
+        return {'name': pageId, 'lastModified': xmlrpclib.DateTime(mtime),
+                'author': "mock", 'version': mtime}
+
+    def getPageHTML(self, pageId):
+        return "<pre>{0}</pre>".format(self.getPage(pageId))
+
+    def putPage(self, pageId, text, params):
+        with self.lock:
+            mtime = self.tick()
+            if text:
+                self.pages[pageId] = mtime
+                self.texts[pageId] = text
+            else:
+                self.pages.pop(pageId, None)
+                self.texts.pop(pageId, None)
+            self.changes.append((mtime, pageId, False))
+        return True
+
+    def setLocks(self, locks):
+        return {'locked': locks.get('lock', []), 'lockfail': [],
+                'unlocked': locks.get('unlock', []), 'unlockfail': []}
+
+    def aclCheck(self, pageId):
+        return 16
+
+    def _recent(self, timestamp, media):
+        with self.lock:
+            changes = [(mtime, itemId) for mtime, itemId, isMedia in self.changes
+                       if isMedia == media and mtime >= timestamp]
+            result = list()
+            for mtime, itemId in changes:
+                if media:
+                    size = len(self.media[itemId][0]) if itemId in self.media else 0
+                else:
+                    size = len(self.text(itemId))
+                result.append({'name': itemId, 'lastModified': xmlrpclib.DateTime(mtime),
+                               'author': "mock", 'version': mtime, 'size': size, 'perms': 16})
+        if not result:
+            raise xmlrpclib.Fault(NO_CHANGES_FAULT, "There are no changes in the specified timeframe")
+        return result
+
+    def getRecentChanges(self, timestamp):
+        return self._recent(timestamp, False)
+
+    def getRecentMediaChanges(self, timestamp):
+        return self._recent(timestamp, True)
+
+    def getAttachments(self, namespace, options):
+        prefix = namespace.strip(":") + ":" if namespace.strip(":") else ""
+        recursive = options.get('recursive', False)
+        with self.lock:
+            return [{'id': mediaId, 'size': len(data), 'mtime': mtime,
+                     'lastModified': xmlrpclib.DateTime(mtime),
+                     'isimg': False, 'writable': True, 'perms': 16}
+                    for mediaId, (data, mtime) in sorted(self.media.items())
+                    if mediaId.startswith(prefix)
+                    and (recursive or ":" not in mediaId[len(prefix):])]
+
+    def getAttachment(self, mediaId):
+        with self.lock:
+            if mediaId not in self.media:
+                raise xmlrpclib.Fault(221, "The requested file does not exist")
+            return xmlrpclib.Binary(self.media[mediaId][0])
+
+    def putAttachment(self, mediaId, data, params):
+        if isinstance(data, xmlrpclib.Binary):
+            data = data.data
+        else:
+            data = base64.b64decode(data)
+        with self.lock:
+            mtime = self.tick()
+            self.media[mediaId] = (data, mtime)
+            self.changes.append((mtime, mediaId, True))
+        return True
+
+    def deleteAttachment(self, mediaId):
+        with self.lock:
+            if self.media.pop(mediaId, None) is None:
+                raise xmlrpclib.Fault(221, "The requested file does not exist")
+            self.changes.append((self.tick(), mediaId, True))
+        return True
+
+
+class RequestHandler(SimpleXMLRPCRequestHandler):
+    rpc_paths = () #any path, the client appends user and password
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True #headers and body are written separately
+
+    def log_message(self, *args):
+        pass
+
+
+class MockServer(ThreadingMixIn, SimpleXMLRPCServer):
+    daemon_threads = True
+
+    def __init__(self, wiki, latency=0.0, port=0):
+        SimpleXMLRPCServer.__init__(self, ("127.0.0.1", port), requestHandler=RequestHandler,
+                                    allow_none=True, logRequests=False)
+        self.latency = latency
+        self.register_introspection_functions()
+        self.register_multicall_functions()
+        for name in ("dokuwiki.getVersion", "dokuwiki.getPagelist", "dokuwiki.setLocks",
+                     "wiki.getRPCVersionSupported", "wiki.getAllPages", "wiki.getPage",
+                     "wiki.getPageVersion", "wiki.getPageVersions", "wiki.getPageInfo",
+                     "wiki.getPageHTML", "wiki.putPage", "wiki.aclCheck",
+                     "wiki.getRecentChanges", "wiki.getRecentMediaChanges",
+                     "wiki.getAttachments", "wiki.getAttachment", "wiki.putAttachment",
+                     "wiki.deleteAttachment"):
+            self.register_function(getattr(wiki, name.split(".")[1]), name)
+
+    def _marshaled_dispatch(self, data, dispatch_method=None, path=None):
+        if self.latency:
+            time.sleep(self.latency)
+        return SimpleXMLRPCServer._marshaled_dispatch(self, data, dispatch_method, path)
+
+
+def serve(wiki, latency=0.0, port=0):
+    """starts a MockServer in a background thread, returns it and its url"""
+    server = MockServer(wiki, latency, port)
+    thread = threading.Thread(target=server.serve_forever, name="mockwiki")
+    thread.daemon = True
+    thread.start()
+    return server, "http://127.0.0.1:{0}".format(server.server_address[1])
+
+
+def addOptions(parser):
+    parser.add_option("--pages", type="int", default=1000, help="number of pages (default %default)")
+    parser.add_option("--page-size", type="int", default=2000, help="page size in bytes (default %default)")
+    parser.add_option("--namespaces", type="int", default=10, help="sub-namespaces per namespace, 0 puts all pages in the root (default %default)")
+    parser.add_option("--depth", type="int", default=2, help="namespace levels (default %default)")
+    parser.add_option("--media", type="int", default=0, help="number of attachments (default %default)")
+    parser.add_option("--media-size", type="int", default=10000, help="attachment size in bytes (default %default)")
+    parser.add_option("--latency", type="float", default=0.0,
+                      help="delay of every request in milliseconds (default %default)")
+
+
+def wikiFromOptions(options):
+    return MockWiki(options.pages, options.page_size, options.namespaces,
+                    options.depth, options.media, options.media_size)
+
+
+def main():
+    parser = optparse.OptionParser(usage="%prog [options]")
+    addOptions(parser)
+    parser.add_option("--port", type="int", default=0, help="port to listen on (default: any free port)")
+    options, args = parser.parse_args()
+    server = MockServer(wikiFromOptions(options), options.latency / 1000.0, options.port)
+    print server.server_address[1]
+    sys.stdout.flush()
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
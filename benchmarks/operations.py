@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+"""
+Throughput and latency of DokuFS operations against a local mock wiki.
+
+Starts benchmarks/mockwiki.py in a separate process and calls the FUSE
+operations of DokuFS directly, without a kernel mount:
+
+  mount      connect() and the initial page tree load
+  readdir    recursive listing of the whole tree
+  getattr    stat storm over every listed path plus misses
+  seqread    open, read in blocks to the end, release
+  randread   open, read one block at a random offset, release
+  write      create a page and write it in blocks, release
+  rewrite    open an existing page, truncate it to 0, write it, release
+
+For every phase the operation rate, the p50 and p99 latency and the
+number of XML-RPC calls (system.multicall counts as one) are reported.
+
+usage: python benchmarks/operations.py [options] [phase ...]
+       (default all phases, see --help for the wiki and mount options)
+"""
+
+import os
+import sys
+import time
+import random
+import logging
+import optparse
+import subprocess
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARKS, ".."))
+
+from mockwiki import addOptions
+from dokuwikifs import DokuFS, DokuFile
+
+PHASES = ("mount", "readdir", "getattr", "seqread", "randread", "write", "rewrite")
+
+
+def percentile(sortedValues, fraction):
+    if not sortedValues:
+        return 0.0
+    return sortedValues[int(round(fraction * (len(sortedValues) - 1)))]
+
+
+def rpcCalls(fs):
+    return dict((method, stats['calls'])
+                for method, stats in fs.metrics.snapshot().get('xmlrpc', {}).items())
+
+
+class Phase(object):
+    """latencies of the timed operations of one phase"""
+
+    def __init__(self, fs, name):
+        self.fs = fs
+        self.name = name
+        self.latencies = list()
+        self.bytes = 0
+
+    def __enter__(self):
+        self.rpcBefore = rpcCalls(self.fs)
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc):
+        self.duration = time.time() - self.start
+        rpcAfter = rpcCalls(self.fs)
+        self.rpc = dict((method, calls - self.rpcBefore.get(method, 0))
+                        for method, calls in rpcAfter.items()
+                        if calls != self.rpcBefore.get(method, 0))
+
+    def time(self, function, *args):
+        start = time.time()
+        result = function(*args)
+        self.latencies.append(time.time() - start)
+        return result
+
+    def report(self, verbose):
+        latencies = sorted(self.latencies)
+        print "{0:>9} {1:>8} {2:>10.0f} {3:>9.3f} {4:>9.3f} {5:>8.0f} {6:>6}".format(
+            self.name, len(latencies), len(latencies) / self.duration if self.duration else 0,
+            percentile(latencies, 0.5) * 1000, percentile(latencies, 0.99) * 1000,
+            self.bytes / 1024.0 / self.duration if self.duration else 0,
+            sum(self.rpc.values()))
+        if verbose:
+            for method, calls in sorted(self.rpc.items()):
+                print "{0:>9} {1:>8} {2}".format("", calls, method)
+
+
+def readFile(path, block):
+    handle = DokuFile(path, os.O_RDONLY)
+    offset = 0
+    while True:
+        data = handle.read(block, offset)
+        if isinstance(data, int) and data < 0:
+            raise IOError(-data, path)
+        offset += len(data)
+        if len(data) < block:
+            break
+    handle.release(os.O_RDONLY)
+    return offset
+
+
+def readBlock(path, block, offset):
+    handle = DokuFile(path, os.O_RDONLY)
+    data = handle.read(block, offset)
+    handle.release(os.O_RDONLY)
+    return len(data)
+
+
+def writeFile(path, data, block):
+    handle = DokuFile(path, os.O_WRONLY | os.O_CREAT)
+    for offset in range(0, len(data), block):
+        handle.write(data[offset:offset+block], offset)
+    result = handle.release(os.O_WRONLY)
+    if result:
+        raise IOError(-result, path)
+    return len(data)
+
+
+def rewriteFile(path, data, block):
+    """like shell redirection without atomic_o_trunc: ftruncate(0), then write"""
+    handle = DokuFile(path, os.O_WRONLY)
+    handle.ftruncate(0)
+    for offset in range(0, len(data), block):
+        handle.write(data[offset:offset+block], offset)
+    result = handle.release(os.O_WRONLY)
+    if result:
+        raise IOError(-result, path)
+    return len(data)
+
+
+def walk(fs, phase, path, files, dirs):
+    names = phase.time(lambda: [entry.name for entry in fs.readdir(path, 0)])
+    for name in names:
+        if name in (".", "..") or (path, name) == ("/", ".dokuwikifs"):
+            continue
+        child = path.rstrip("/") + "/" + name
+        st = fs.getattr(child)
+        if st.st_mode & 0040000:
+            dirs.append(child)
+            walk(fs, phase, child, files, dirs)
+        else:
+            files.append((child, st.st_size))
+
+
+def run(options, phases, url):
+    fs = DokuFS()
+    fs.url = url
+    fs.username = "bench"
+    fs.password = "bench"
+    for option in options.option:
+        key, value = option.split("=", 1)
+        setattr(fs, key, value)
+    DokuFile.fs = fs
+    fs.file_class = DokuFile
+    rand = random.Random(options.seed)
+    results = list()
+
+    with Phase(fs, "mount") as phase:
+        phase.time(fs.connect)
+    fs.fsinit()
+    results.append(phase)
+
+    files, dirs = list(), ["/"]
+    with Phase(fs, "readdir") as phase:
+        walk(fs, phase, "/", files, dirs)
+    results.append(phase)
+    files.sort()
+
+    if "getattr" in phases:
+        paths = dirs + [path for path, size in files]
+        paths += [path + "missing" for path, size in files[:len(files) // 10]]
+        with Phase(fs, "getattr") as phase:
+            for i in xrange(options.rounds):
+                rand.shuffle(paths)
+                for path in paths:
+                    phase.time(fs.getattr, path)
+        results.append(phase)
+
+    if "seqread" in phases:
+        with Phase(fs, "seqread") as phase:
+            for path, size in files[:options.files]:
+                phase.bytes += phase.time(readFile, path, options.block)
+        results.append(phase)
+
+    if "randread" in phases:
+        with Phase(fs, "randread") as phase:
+            for i in xrange(options.files):
+                path, size = rand.choice(files)
+                offset = rand.randrange(max(size - options.block, 0) + 1)
+                phase.bytes += phase.time(readBlock, path, options.block, offset)
+        results.append(phase)
+
+    if "write" in phases:
+        data = ("benchmark text " * (options.page_size // 15 + 1))[:options.page_size]
+        with Phase(fs, "write") as phase:
+            for i in xrange(options.files):
+                phase.bytes += phase.time(writeFile, "/benchmark/write{0}".format(i),
+                                          data, options.block)
+        results.append(phase)
+
+    if "rewrite" in phases:
+        data = ("rewritten text " * (options.page_size // 15 + 1))[:options.page_size]
+        with Phase(fs, "rewrite") as phase:
+            for path, size in files[:options.files]:
+                phase.bytes += phase.time(rewriteFile, path, data, options.block)
+        results.append(phase)
+
+    fs.fsdestroy()
+    return [phase for phase in results if phase.name in phases]
+
+
+def main():
+    parser = optparse.OptionParser(usage="%prog [options] [phase ...]")
+    addOptions(parser)
+    parser.add_option("-o", dest="option", action="append", default=[],
+                      help="DokuFS mount option key=value, repeatable, e.g. -o refresh=lazy")
+    parser.add_option("--rounds", type="int", default=3, help="getattr: passes over all paths (default %default)")
+    parser.add_option("--files", type="int", default=200, help="reads and writes: files per phase (default %default)")
+    parser.add_option("--block", type="int", default=4096, help="read and write size in bytes (default %default)")
+    parser.add_option("--seed", type="int", default=1, help="random seed (default %default)")
+    parser.add_option("-v", dest="verbose", action="store_true", help="list the XML-RPC calls of each phase")
+    options, phases = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    for phase in phases:
+        if phase not in PHASES:
+            parser.error("unknown phase {0}, one of {1}".format(phase, ", ".join(PHASES)))
+
+    mock = subprocess.Popen([sys.executable, os.path.join(BENCHMARKS, "mockwiki.py"),
+                             "--pages", str(options.pages), "--page-size", str(options.page_size),
+                             "--namespaces", str(options.namespaces), "--depth", str(options.depth),
+                             "--media", str(options.media), "--media-size", str(options.media_size),
+                             "--latency", str(options.latency)],
+                            stdout=subprocess.PIPE)
+    port = mock.stdout.readline().strip()
+    try:
+        results = run(options, phases or PHASES,
+                      "http://127.0.0.1:{0}".format(port))
+    finally:
+        mock.terminate()
+
+    print "{0:>9} {1:>8} {2:>10} {3:>9} {4:>9} {5:>8} {6:>6}".format(
+        "phase", "ops", "ops/s", "p50 ms", "p99 ms", "KiB/s", "rpcs")
+    for phase in results:
+        phase.report(options.verbose)
+
+
+if __name__ == '__main__':
+    main()
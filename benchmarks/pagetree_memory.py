@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+"""
+Memory used by the page tree for synthetic wikis.
+
+Compares the slotted tree of dokuwikitree with the former representation
+(one fuse.Stat subclass per page, nested dicts and a flat index of every
+path). Each structure is built in a fresh interpreter and the growth of
+its resident set size is reported.
+
+usage: python benchmarks/pagetree_memory.py [pages ...]
+       (default 10000 100000 1000000)
+"""
+
+import os
+import sys
+import stat
+import time
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import fuse
+from dokuwikitree import DokuPage, newTree, insertEntry
+
+
+class LegacyPage(fuse.Stat):
+    """DokuPage as it was before dokuwikitree"""
+    def __init__(self,path,*foo):
+        self.path = path
+        self.id = path.replace("/", ":")
+
+        self.st_mode = stat.S_IFREG | 0666
+        self.st_ino = 0
+        self.st_dev = 0
+        self.st_nlink = 1
+        self.st_uid = 0
+        self.st_gid = 0
+
+        self.st_size = 0
+        self.st_atime = 0
+        self.st_mtime = 0
+        self.st_ctime = 0
+
+
+def pageIds(count):
+    """ids spread over about 3000 namespaces two levels deep"""
+    for i in xrange(count):
+        if i % 50 == 0:
+            name = "start"
+        else:
+            name = "page{0}".format(i)
+        yield "project{0}:topic{1}:{2}".format(i % 97, i % 31, name)
+
+
+def buildLegacy(count):
+    tree = dict()
+    index = {"/": tree}
+    for pageId in pageIds(count):
+        page = LegacyPage("/" + pageId.replace(":", "/"))
+        page.id = pageId
+        page.st_size = 1000
+        page.st_atime = page.st_mtime = page.st_ctime = 1300000000
+        path = page.path[1:].split("/")
+        myRoot = tree
+        myPath = ""
+        for pathElem in path[:-1]:
+            myPath += "/" + pathElem
+            if not myRoot.has_key(pathElem):
+                myRoot[pathElem] = dict()
+                index[myPath] = myRoot[pathElem]
+            myRoot = myRoot[pathElem]
+        myRoot[path[-1]] = page
+        index[page.path] = page
+    return tree, index
+
+
+def buildCompact(count):
+    tree, index = newTree()
+    for pageId in pageIds(count):
+        insertEntry(tree, index, "/" + pageId.replace(":", "/"), DokuPage(1000, 1300000000))
+    return tree, index
+
+
+def rss():
+    """resident set size in bytes"""
+    with open("/proc/self/statm") as statm:
+        return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def child(structure, count):
+    build = {"legacy": buildLegacy, "compact": buildCompact}[structure]
+    before = rss()
+    start = time.time()
+    tree = build(count)
+    duration = time.time() - start
+    print rss() - before, duration
+
+
+def main(counts):
+    print "{0:>9} {1:>8} {2:>10} {3:>10} {4:>8}".format("pages", "tree", "MiB", "bytes/page", "build s")
+    for count in counts:
+        for structure in ("legacy", "compact"):
+            output = subprocess.check_output([sys.executable, os.path.abspath(__file__),
+                                              "--child", structure, str(count)])
+            used, duration = output.split()
+            print "{0:>9} {1:>8} {2:>10.1f} {3:>10} {4:>8.2f}".format(
+                count, structure, int(used) / 1048576.0, int(used) // count, float(duration))
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ["--child"]:
+        child(sys.argv[2], int(sys.argv[3]))
+    else:
+        main([int(arg) for arg in sys.argv[1:]] or [10000, 100000, 1000000])
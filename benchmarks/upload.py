@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+"""
+Throughput and peak memory of attachment uploads.
+
+Compares DokuWikiClient.put_file(), which encodes the whole attachment in
+memory, with put_file_stream(), which base64 encodes it chunk by chunk
+from a file. Uploads go to a local server which discards the request
+body, so the numbers show the cost on the client side. Each upload runs
+in a fresh interpreter; peak is the growth of its maximum RSS during
+the upload.
+
+usage: python benchmarks/upload.py [megabytes ...]
+       (default 1 50 200)
+"""
+
+import os
+import sys
+import time
+import resource
+import tempfile
+import subprocess
+import BaseHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from dokuwikixmlrpc import DokuWikiClient
+
+RESPONSE = ("<?xml version='1.0'?>\n<methodResponse><params><param>"
+            "<value><boolean>1</boolean></value>"
+            "</param></params></methodResponse>\n")
+
+
+class SinkHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """reads and drops the request body, answers true"""
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        remaining = int(self.headers["content-length"])
+        while remaining > 0:
+            remaining -= len(self.rfile.read(min(remaining, 1024*1024)))
+        self.send_response(200)
+        self.send_header("Content-Type", "text/xml")
+        self.send_header("Content-Length", str(len(RESPONSE)))
+        self.end_headers()
+        self.wfile.write(RESPONSE)
+
+    def log_message(self, *args):
+        pass
+
+
+def server():
+    httpd = BaseHTTPServer.HTTPServer(("127.0.0.1", 0), SinkHandler)
+    print httpd.server_address[1]
+    sys.stdout.flush()
+    httpd.serve_forever()
+
+
+def maxrss():
+    """peak resident set size in bytes"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def client(method, size, port):
+    block = os.urandom(1024*1024)
+    with tempfile.TemporaryFile() as data:
+        for i in range(size // len(block)):
+            data.write(block)
+        data.write(block[:size % len(block)])
+        data.flush()
+        del block
+
+        dokuwiki = DokuWikiClient("http://127.0.0.1:{0}".format(port), "user", "secret",
+                                  check_version=False, gzip=False)
+        before = maxrss()
+        start = time.time()
+        if method == "put_file":
+            data.seek(0)
+            dokuwiki.put_file("bench:upload.bin", data.read(), True)
+        else:
+            dokuwiki.put_file_stream("bench:upload.bin", data, size, True)
+        duration = time.time() - start
+    print maxrss() - before, duration
+
+
+def main(sizes):
+    sink = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--server"],
+                            stdout=subprocess.PIPE)
+    port = sink.stdout.readline().strip()
+    try:
+        print "{0:>6} {1:>16} {2:>10} {3:>8}".format("MB", "method", "peak MiB", "MB/s")
+        for megabytes in sizes:
+            for method in ("put_file", "put_file_stream"):
+                output = subprocess.check_output([sys.executable, os.path.abspath(__file__),
+                                                  "--client", method,
+                                                  str(megabytes*1024*1024), port])
+                peak, duration = output.split()
+                print "{0:>6} {1:>16} {2:>10.1f} {3:>8.1f}".format(
+                    megabytes, method, int(peak) / 1048576.0, megabytes / float(duration))
+    finally:
+        sink.terminate()
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ["--server"]:
+        server()
+    elif sys.argv[1:2] == ["--client"]:
+        client(sys.argv[2], int(sys.argv[3]), sys.argv[4])
+    else:
+        main([int(arg) for arg in sys.argv[1:]] or [1, 50, 200])
@@ -0,0 +1,389 @@
+"""Caches used by the DokuWiki FUSE driver."""
+
+import os
+import mmap
+import hashlib
+import logging
+import sqlite3
+import tempfile
+import threading
+from collections import OrderedDict, deque
+
+
+class PageCache(object):
+    """LRU cache for page bodies keyed by (page id, revision).
+
+    The revision is the page mtime as reported by the wiki, so a cached body
+    never goes stale: a newer revision simply misses and the old one ages
+    out. Entries are evicted least-recently-used first as soon as the sum of
+    the cached bodies exceeds maxBytes. All methods are thread-safe.
+    """
+
+    def __init__(self, maxBytes):
+        self.maxBytes = maxBytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._revisions = dict() #pageId -> set of cached revisions
+        self._lock = threading.Lock()
+
+    def get(self, pageId, revision):
+        key = (pageId, revision)
+        with self._lock:
+            buf = self._entries.pop(key, None)
+            if buf is None:
+                self.misses += 1
+                return None
+            self._entries[key] = buf #move to most recently used position
+            self.hits += 1
+            return buf
+
+    def put(self, pageId, revision, buf):
+        key = (pageId, revision)
+        if len(buf) > self.maxBytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self._entries[key] = buf
+            self._revisions.setdefault(pageId, set()).add(revision)
+            self.size += len(buf)
+            while self.size > self.maxBytes:
+                evictedKey, evicted = self._entries.popitem(last=False)
+                self._forget(evictedKey)
+                self.size -= len(evicted)
+                self.evictions += 1
+
+    def _forget(self, key):
+        revisions = self._revisions[key[0]]
+        revisions.discard(key[1])
+        if not revisions:
+            del self._revisions[key[0]]
+
+    def contains(self, pageId, revision=None):
+        """True if revision (or any revision) of pageId is cached."""
+        if revision is None:
+            return pageId in self._revisions
+        return revision in self._revisions.get(pageId, ())
+
+    def discard(self, pageId):
+        """Drop every cached revision of pageId."""
+        with self._lock:
+            for revision in self._revisions.pop(pageId, ()):
+                self.size -= len(self._entries.pop((pageId, revision)))
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries),
+                    'bytes': self.size,
+                    'maxBytes': self.maxBytes,
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions}
+
+
+class Prefetcher(object):
+    """Bounded read-ahead queue served by a pool of worker threads.
+
+    Pages are queued as tree entries (anything with id and st_size). The
+    queue holds at most maxPages entries and maxBytes of expected page size;
+    entries beyond that are dropped, enqueue() never blocks. Each worker
+    takes up to batchSize entries at a time and passes them to fetch(),
+    which is expected to load them into the page cache.
+    """
+
+    def __init__(self, fetch, workers, maxPages, maxBytes, batchSize):
+        self.log = logging.getLogger("Prefetcher")
+        self.workers = workers
+        self.maxPages = maxPages
+        self.maxBytes = maxBytes
+        self.batchSize = batchSize
+        self.size = 0
+        self.queued = 0
+        self.dropped = 0
+        self.fetched = 0
+        self._fetch = fetch
+        self._queue = deque()
+        self._ids = set()
+        self._condition = threading.Condition()
+        self._threads = list()
+        self._stopped = False
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name="prefetch-{0}".format(i))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._queue.clear()
+            self._ids.clear()
+            self.size = 0
+            self._condition.notify_all()
+
+    def enqueue(self, entries):
+        with self._condition:
+            for entry in entries:
+                if entry.id in self._ids:
+                    continue
+                if len(self._queue) >= self.maxPages \
+                        or self.size + entry.st_size > self.maxBytes:
+                    self.dropped += 1
+                    continue
+                self._queue.append(entry)
+                self._ids.add(entry.id)
+                self.size += entry.st_size
+                self.queued += 1
+            self._condition.notify_all()
+
+    def _take(self):
+        with self._condition:
+            while not self._queue and not self._stopped:
+                self._condition.wait()
+            batch = list()
+            while self._queue and len(batch) < self.batchSize:
+                entry = self._queue.popleft()
+                self._ids.discard(entry.id)
+                self.size -= entry.st_size
+                batch.append(entry)
+            return batch
+
+    def _run(self):
+        while not self._stopped:
+            batch = self._take()
+            if not batch:
+                continue
+            try:
+                self._fetch(batch)
+                self.fetched += len(batch)
+            except Exception,e:
+                self.log.error("prefetch of {0} pages failed: {1}".format(len(batch), str(e)))
+
+    def stats(self):
+        with self._condition:
+            return {'workers': self.workers,
+                    'queuedPages': len(self._queue),
+                    'queuedBytes': self.size,
+                    'queued': self.queued,
+                    'dropped': self.dropped,
+                    'fetched': self.fetched}
+
+
+class DiskCache(object):
+    """SQLite file keeping the page tree and page bodies across remounts.
+
+    The pages and media tables mirror the page tree (id, size, mtime) of
+    pages and attachments, the meta table
+    holds the wiki timestamp of the newest change applied to it and the time
+    of the last successful refresh. bodies stores the newest cached revision
+    of each page. All methods are thread-safe.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.text_factory = str
+        with self._lock:
+            self._db.executescript("""
+                PRAGMA journal_mode = WAL;
+                PRAGMA synchronous = NORMAL;
+                CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER);
+                CREATE TABLE IF NOT EXISTS pages (id TEXT PRIMARY KEY, size INTEGER, mtime INTEGER);
+                CREATE TABLE IF NOT EXISTS media (id TEXT PRIMARY KEY, size INTEGER, mtime INTEGER);
+                CREATE TABLE IF NOT EXISTS bodies (id TEXT PRIMARY KEY, revision INTEGER, body BLOB);
+            """)
+
+    def _meta(self, key):
+        row = self._db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _setMeta(self, lastChange, syncTime):
+        self._db.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                             [("lastChange", lastChange), ("syncTime", syncTime)])
+
+    def loadPages(self):
+        """
+        returns (pages, media, lastChange, syncTime) with pages and media as
+        lists of (id, size, mtime), lastChange is None if nothing was stored yet
+        """
+        with self._lock:
+            pages = self._db.execute("SELECT id, size, mtime FROM pages").fetchall()
+            media = self._db.execute("SELECT id, size, mtime FROM media").fetchall()
+            return pages, media, self._meta("lastChange"), self._meta("syncTime") or 0
+
+    def savePages(self, pages, media, lastChange, syncTime):
+        """replaces the stored tree with pages and media, iterables of (id, size, mtime)"""
+        with self._lock:
+            with self._db:
+                self._db.execute("DELETE FROM pages")
+                self._db.executemany("INSERT OR REPLACE INTO pages (id, size, mtime) VALUES (?, ?, ?)", pages)
+                self._db.execute("DELETE FROM media")
+                self._db.executemany("INSERT OR REPLACE INTO media (id, size, mtime) VALUES (?, ?, ?)", media)
+                self._db.execute("DELETE FROM bodies WHERE id NOT IN (SELECT id FROM pages)")
+                self._setMeta(lastChange, syncTime)
+
+    def updatePages(self, changed, removed, changedMedia, removedMedia, lastChange, syncTime):
+        """
+        applies a delta: changed and changedMedia are lists of (id, size,
+        mtime), removed and removedMedia lists of ids
+        """
+        with self._lock:
+            with self._db:
+                self._db.executemany("INSERT OR REPLACE INTO pages (id, size, mtime) VALUES (?, ?, ?)", changed)
+                self._db.executemany("DELETE FROM pages WHERE id = ?", [(pageId,) for pageId in removed])
+                self._db.executemany("DELETE FROM bodies WHERE id = ?", [(pageId,) for pageId in removed])
+                self._db.executemany("INSERT OR REPLACE INTO media (id, size, mtime) VALUES (?, ?, ?)", changedMedia)
+                self._db.executemany("DELETE FROM media WHERE id = ?", [(mediaId,) for mediaId in removedMedia])
+                self._setMeta(lastChange, syncTime)
+
+    def get(self, pageId, revision):
+        with self._lock:
+            row = self._db.execute("SELECT body FROM bodies WHERE id = ? AND revision = ?",
+                                   (pageId, revision)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return str(row[0])
+
+    def put(self, pageId, revision, buf):
+        with self._lock:
+            with self._db:
+                self._db.execute("INSERT OR REPLACE INTO bodies (id, revision, body) VALUES (?, ?, ?)",
+                                 (pageId, revision, sqlite3.Binary(buf)))
+
+    def discard(self, pageId):
+        with self._lock:
+            with self._db:
+                self._db.execute("DELETE FROM bodies WHERE id = ?", (pageId,))
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def stats(self):
+        with self._lock:
+            pages, = self._db.execute("SELECT COUNT(*) FROM pages").fetchone()
+            bodies, = self._db.execute("SELECT COUNT(*) FROM bodies").fetchone()
+            return {'path': self.path,
+                    'pages': pages,
+                    'bodies': bodies,
+                    'hits': self.hits,
+                    'misses': self.misses}
+
+
+class MediaCache(object):
+    """Directory of downloaded attachment revisions, read through mmap.
+
+    Every attachment revision is downloaded once into a file named after
+    the attachment id and revision, further reads map that file instead of
+    keeping the data in memory. Files are evicted least-recently-used first
+    once they take more than maxBytes; a mapping stays valid until it is
+    closed even if its file is evicted meanwhile. Files left by an earlier
+    mount are reused. All methods are thread-safe.
+    """
+
+    def __init__(self, path, maxBytes):
+        self.path = path
+        self.maxBytes = maxBytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._files = OrderedDict() #file name -> size, least recently used first
+        self._revisions = dict() #media id hash -> file name
+        self._fetching = dict() #file name -> lock held while it is downloaded
+        self._lock = threading.Lock()
+        if not os.path.isdir(path):
+            os.makedirs(path, 0700)
+        names = [name for name in os.listdir(path) if "-" in name and not name.startswith(".")]
+        for name in sorted(names, key=lambda name: os.path.getatime(os.path.join(path, name))):
+            self._add(name, os.path.getsize(os.path.join(path, name)))
+
+    def _fileName(self, mediaId, revision):
+        return "{0}-{1}".format(hashlib.sha1(mediaId).hexdigest(), revision)
+
+    def _add(self, name, size):
+        key = name.split("-")[0]
+        old = self._revisions.get(key)
+        if old is not None and old != name:
+            self._remove(old)
+        self._revisions[key] = name
+        self._files[name] = size
+        self.size += size
+        while self.size > self.maxBytes and len(self._files) > 1:
+            self._remove(next(iter(self._files)))
+            self.evictions += 1
+
+    def _remove(self, name):
+        self.size -= self._files.pop(name)
+        key = name.split("-")[0]
+        if self._revisions.get(key) == name:
+            del self._revisions[key]
+        try:
+            os.unlink(os.path.join(self.path, name))
+        except OSError:
+            pass
+
+    def open(self, mediaId, revision, fetch):
+        """
+        returns a read-only mmap (or "" for an empty file) of the given
+        revision, calling fetch() for its content if it is not cached yet
+        """
+        name = self._fileName(mediaId, revision)
+        with self._lock:
+            fetchLock = self._fetching.setdefault(name, threading.Lock())
+        with fetchLock: #concurrent readers of a new revision download it once
+            try:
+                with self._lock:
+                    cacheFile = None
+                    if name in self._files:
+                        self._files[name] = self._files.pop(name)
+                        self.hits += 1
+                        cacheFile = open(os.path.join(self.path, name), "rb")
+                if cacheFile is None:
+                    cacheFile = self._store(name, fetch())
+            finally:
+                with self._lock:
+                    self._fetching.pop(name, None)
+        with cacheFile:
+            if os.fstat(cacheFile.fileno()).st_size == 0:
+                return ""
+            return mmap.mmap(cacheFile.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _store(self, name, data):
+        """writes data to the cache file name and returns it opened for reading"""
+        fd, tmpPath = tempfile.mkstemp(prefix=".", dir=self.path)
+        with os.fdopen(fd, "wb") as tmpFile:
+            tmpFile.write(data)
+        with self._lock:
+            os.rename(tmpPath, os.path.join(self.path, name))
+            self.misses += 1
+            self._add(name, len(data))
+            return open(os.path.join(self.path, name), "rb")
+
+    def discard(self, mediaId):
+        """removes the cached revision of mediaId"""
+        with self._lock:
+            name = self._revisions.get(hashlib.sha1(mediaId).hexdigest())
+            if name is not None:
+                self._remove(name)
+
+    def stats(self):
+        with self._lock:
+            return {'path': self.path,
+                    'files': len(self._files),
+                    'bytes': self.size,
+                    'maxBytes': self.maxBytes,
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions}
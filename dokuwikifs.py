@@ -3,60 +3,86 @@
 #while true; do sudo python dokuwikifs.py -f -o url="http://site/lib/exe/xmlrpc.php",username="foo",password="bla",allow_other testpath; sleep 1; done
 
 import os
+import re
 import errno
 import fuse
 import stat
 import time
+import shutil
+import calendar
+import tempfile
+from cStringIO import StringIO
+import hashlib
+import threading
 import logging
+import json
+import itertools
 from xml.parsers.expat import ExpatError
-from dokuwikixmlrpc import DokuWikiClient, DokuWikiXMLRPCError
-
-logging.basicConfig(level=logging.DEBUG)
+from dokuwikixmlrpc import DokuWikiClientPool, DokuWikiXMLRPCError
+from dokuwikicache import PageCache, Prefetcher, DiskCache, MediaCache
+from dokuwikitree import DokuPage, DokuMedia, newTree, insertEntry, lookup, inode
+from dokuwikistats import Metrics, instrumented
+from dokuwikilocks import LockManager, LOCK_DELAY, UNLOCK_DELAY
 
 if not hasattr(fuse, '__version__'):
     raise RuntimeError, \
         "your fuse-py doesn't know of fuse.__version__, probably it's too old."
  
 fuse.fuse_python_api = (0, 2)
+
+#fault code of wiki.getRecentChanges if nothing changed since the timestamp
+NO_CHANGES_FAULT = 321
+
+#revisions remembered for keep_cache, like checkpathCacheSize
+kernelRevisionsSize = 100000
+
+#namespaces whose readdir() snapshot answers getattr()
+listingsSize = 64
+
+#refresh=lazy: listing times kept, including those of paths that are no namespace
+nsLoadTimeSize = 100000
+
+#virtual directory next to the wiki pages, hidden from checkpath()
+STATS_DIR = "/.dokuwikifs"
+STATS_PATH = STATS_DIR + "/stats"
+
+#read-only history, /.versions/<page path>/<revision>; not listed in /
+#so that backup tools walking the mount do not fetch every old revision
+VERSIONS_DIR = "/.versions"
+
+#read-only rendered pages, /.html/<page path>.html, not listed in / either
+HTML_DIR = "/.html"
+HTML_SUFFIX = ".html"
+
+#pages whose revision list is kept, like checkpathCacheSize
+versionListsSize = 10000
+
+cleanPathRe = re.compile(r"^[a-z0-9._/]*\Z")
+checkpathCache = dict()
+checkpathCacheSize = 64*1024
+
+def fsMetrics(fs):
+    return fs.metrics
+
+def fileMetrics(handle):
+    return handle.fs.metrics
+
 def checkpath(path):
     """
     returns true if path is a clean dokuwiki id
     TODO and FIXME
     """
+    try:
+        return checkpathCache[path]
+    except KeyError:
+        pass
     filename = os.path.basename(path)
-    dirname = os.path.dirname(path)
-    logging.getLogger("checkpath").debug("filename={0} dirname={1} path={2}".format(filename,dirname, path))
-    allowedChars = map(lambda char: chr(char), range(ord("a"),ord("z")+1))
-    allowedChars.extend([".","/","_"])
-    allowedChars.extend(map(lambda char: chr(char), range(ord("0"), ord("9")+1)))
-    pathCharOk = True
-    for pathChar in path:
-        pathCharOk = pathCharOk and pathChar in allowedChars
-    return ":" not in path \
-        and ( len(filename)>0 
-              and filename[0] not in (".")  
-              or len(filename) == 0) \
-        and pathCharOk
-
-class DokuPage(fuse.Stat):
-    def __init__(self,path,*foo):
-        self.path = path
-        self.id = path.replace("/", ":")
-        
-        self.st_mode = stat.S_IFREG | 0666
-        self.st_ino = 0
-        self.st_dev = 0
-        self.st_nlink = 1
-        self.st_uid = 0
-        self.st_gid = 0
-
-        self.st_size = 0
-        self.st_atime = 0
-        self.st_mtime = 0
-        self.st_ctime = 0
-
-    def __repr__(self):
-        return "DokuPage path={0} id={1}".format(self.path, self.id)
+    result = cleanPathRe.match(path) is not None \
+        and not filename.startswith(".")
+    if len(checkpathCache) >= checkpathCacheSize:
+        checkpathCache.clear()
+    checkpathCache[path] = result
+    return result
 
 class DokuFS(fuse.Fuse):
     usage = """Doku Wiki Fuse driver
@@ -68,6 +94,35 @@ for your user account in localconfig.php on server-side.
 Try -d to see whats going on
 """
     def __init__(self, *args, **kw):
+        self.cache_size = 32*1024*1024
+        self.refresh = "changes"
+        self.changes_window = 24*60*60
+        self.refresh_interval = 5
+        self.max_stale = 5*60
+        self.pool_size = 4
+        self.gzip = 1
+        self.gzip_threshold = 0
+        self.batch_size = 50
+        self.prefetch = 0
+        self.prefetch_pages = 1000
+        self.prefetch_bytes = 8*1024*1024
+        self.cache_dir = None
+        self.media = 1
+        self.media_extensions = "jpg,jpeg,gif,png,svg,ico,webp,swf,mp3,ogg,wav,webm,ogv,mp4,vtt,tgz,tar,gz,bz2,zip,rar,7z,pdf,txt,csv,doc,dot,xls,ppt,rtf,docx,xlsx,pptx,odt,ods,odp,odg"
+        self.media_cache_size = 256*1024*1024
+        self.startup = "wait"
+        self.loglevel = "warning"
+        self.attr_timeout = 1
+        self.entry_timeout = 1
+        self.negative_timeout = 1
+        self.kernel_cache = 0
+        self.versions = 1
+        self.versions_cache_size = 32*1024*1024
+        self.html = 1
+        self.html_cache_size = 32*1024*1024
+        self.lock_renew = 10*60
+        self.ns_timeout = 30
+        self.root = ""
         fuse.Fuse.__init__(self, *args, **kw)
         self.parser.add_option(mountopt="url",
                                help="Dokuwiki XMLRPC URL (including lib/exe/xmlrpc.php)")
@@ -75,79 +130,1089 @@ Try -d to see whats going on
                                help="Wiki Username")
         self.parser.add_option(mountopt="password",
                               help="Wiki Password")
+        self.parser.add_option(mountopt="cache_size",
+                               help="Memory cap for cached page contents in bytes (default {0})".format(self.cache_size))
+        self.parser.add_option(mountopt="refresh",
+                               help="Page tree refresh mode: 'changes' applies wiki.getRecentChanges deltas, 'full' relists the whole wiki, 'lazy' lists each namespace when it is first browsed (default {0})".format(self.refresh))
+        self.parser.add_option(mountopt="refresh_interval",
+                               help="Seconds between two page tree refreshes done in the background (default {0})".format(self.refresh_interval))
+        self.parser.add_option(mountopt="max_stale",
+                               help="Refresh the page tree in the foreground once it is older than this many seconds, e.g. while the wiki is slow (default {0})".format(self.max_stale))
+        self.parser.add_option(mountopt="ns_timeout",
+                               help="refresh=lazy: seconds a namespace listing is reused (default {0})".format(self.ns_timeout))
+        self.parser.add_option(mountopt="root",
+                               help="Mount only this namespace, e.g. root=projects:web (default: whole wiki)")
+        self.parser.add_option(mountopt="changes_window",
+                               help="Relist the whole wiki if the last refresh is older than this many seconds (default {0})".format(self.changes_window))
+        self.parser.add_option(mountopt="pool_size",
+                               help="Number of concurrent XMLRPC connections used by the FUSE worker threads (default {0})".format(self.pool_size))
+        self.parser.add_option(mountopt="gzip",
+                               help="1 requests gzip compressed responses from the wiki, 0 disables it (default {0})".format(self.gzip))
+        self.parser.add_option(mountopt="gzip_threshold",
+                               help="Send requests of at least this many bytes gzip compressed, e.g. large page saves, 0 disables it. The web server has to decode them (default {0})".format(self.gzip_threshold))
+        self.parser.add_option(mountopt="batch_size",
+                               help="Maximum number of calls sent in one system.multicall request (default {0})".format(self.batch_size))
+        self.parser.add_option(mountopt="prefetch",
+                               help="Number of worker threads loading the pages of listed directories in the background, 0 disables read-ahead (default {0})".format(self.prefetch))
+        self.parser.add_option(mountopt="prefetch_pages",
+                               help="Maximum number of pages waiting for read-ahead (default {0})".format(self.prefetch_pages))
+        self.parser.add_option(mountopt="prefetch_bytes",
+                               help="Maximum size of the pages waiting for read-ahead in bytes (default {0})".format(self.prefetch_bytes))
+        self.parser.add_option(mountopt="cache_dir",
+                               help="Directory for a persistent page tree and content cache reused by later mounts (default: none)")
+        self.parser.add_option(mountopt="media",
+                               help="1 shows the attachments of the wiki as files next to the pages, 0 hides them (default {0})".format(self.media))
+        self.parser.add_option(mountopt="media_extensions",
+                               help="Comma separated extensions of new files uploaded as attachments, other new files become pages; the wiki accepts those of its mime.conf (default {0})".format(self.media_extensions))
+        self.parser.add_option(mountopt="media_cache_size",
+                               help="Disk space for downloaded attachments in bytes, kept in cache_dir or a temporary directory (default {0})".format(self.media_cache_size))
+        self.parser.add_option(mountopt="attr_timeout",
+                               help="Seconds the kernel caches file attributes (default {0})".format(self.attr_timeout))
+        self.parser.add_option(mountopt="entry_timeout",
+                               help="Seconds the kernel caches name lookups (default {0})".format(self.entry_timeout))
+        self.parser.add_option(mountopt="negative_timeout",
+                               help="Seconds the kernel caches failed name lookups, 0 disables it (default {0})".format(self.negative_timeout))
+        self.parser.add_option(mountopt="kernel_cache",
+                               help="1 keeps file contents in the kernel page cache across opens even if the page changed on the wiki, 0 only keeps them while the revision is unchanged (default {0})".format(self.kernel_cache))
+        self.parser.add_option(mountopt="versions",
+                               help="1 shows the old revisions of a page as files in /.versions/<page>/, the directory is not listed in / (default {0})".format(self.versions))
+        self.parser.add_option(mountopt="versions_cache_size",
+                               help="Memory cap for cached old revisions in bytes, they never change and are not revalidated (default {0})".format(self.versions_cache_size))
+        self.parser.add_option(mountopt="html",
+                               help="1 shows every page rendered by the wiki as /.html/<page>.html, the directory is not listed in / (default {0})".format(self.html))
+        self.parser.add_option(mountopt="html_cache_size",
+                               help="Memory cap for rendered pages in bytes, a page is rendered again once its mtime changes (default {0})".format(self.html_cache_size))
+        self.parser.add_option(mountopt="lock_renew",
+                               help="Seconds after which the lock of a page open for writing is renewed, must stay below the locktime of the wiki and above {1}s (default {0})".format(self.lock_renew, max(LOCK_DELAY, UNLOCK_DELAY)))
+        self.parser.add_option(mountopt="loglevel",
+                               help="debug, info, warning or error (default {0})".format(self.loglevel))
+        self.parser.add_option(mountopt="startup",
+                               help="'wait' checks the wiki and loads the page tree before mounting, 'lazy' mounts at once and does both in the background, connection errors only show in the log (default {0})".format(self.startup))
 
         self.log = logging.getLogger("DokuFS")
-        self.pagetreeCache = dict()
-        self.pagetreeCacheTime = 0
-        self.pagetreeCacheTimeout = 5
+        self.metrics = Metrics()
+        self.pagetreeCache, self.pathIndex = newTree() #pathIndex: namespace path -> DokuNamespace
+        self.pagetreeCacheTime = 0 #last refresh attempt
+        self.pagetreeSyncTime = 0 #start of the last successful refresh
+        self.lastChange = None #wiki timestamp of the newest change in the tree
+        self.diskCacheSyncTime = 0 #sync time last written to the disk cache
+        self.refreshLock = threading.Lock() #one refresh at a time
+        self.refreshStop = threading.Event()
+        self.refreshCount = 0
+        self.refreshFailures = 0
+        self.refreshDuration = 0 #of the last successful refresh
+        self.refreshMaxDuration = 0
+        self.nsLoadTime = dict() #refresh=lazy: namespace path -> time of its last listing
+        self.openFiles = dict() #path -> [DokuFile]
+        self.kernelRevisions = dict() #path -> (st_mtime, st_size) the kernel may have cached
+        self.treeLock = threading.RLock() #guards pagetreeCache, pathIndex, openFiles and kernelRevisions
+        self.mounted = False #set by main(), Invalidate() needs a running fuse loop
+        self.listings = dict() #namespace path -> (DokuNamespace, time) of recent readdir() calls
+        self.versionLists = dict() #page id -> (st_mtime, sorted revisions) of /.versions
 
     def connect(self):
         self.log.info("connect")
         try:
-            self.dokuwiki = DokuWikiClient(self.url,
-                                           self.username,
-                                           self.password)
-            self.log.info( "RPC Version: {0}".format(self.dokuwiki.rpc_version_supported()) )
-            self._pagelist(cache=False)
+            self.dokuwiki = DokuWikiClientPool(int(self.pool_size),
+                                               self.url,
+                                               self.username,
+                                               self.password,
+                                               check_version=False,
+                                               gzip=bool(int(self.gzip)),
+                                               gzip_threshold=int(self.gzip_threshold),
+                                               observer=self.metrics.xmlrpc)
+            self.pageCache = PageCache(int(self.cache_size))
+            self.locks = LockManager(lambda locks: self.dokuwiki.set_locks(locks),
+                                     float(self.lock_renew))
+            self.versions = bool(int(self.versions))
+            self.versionCache = PageCache(int(self.versions_cache_size))
+            self.html = bool(int(self.html))
+            self.htmlCache = PageCache(int(self.html_cache_size))
+            self.changes_window = int(self.changes_window)
+            self.refresh_interval = int(self.refresh_interval)
+            self.max_stale = int(self.max_stale)
+            self.batch_size = int(self.batch_size)
+            self.ns_timeout = int(self.ns_timeout)
+            self.root = self.root.strip(":")
+            self.idPrefix = self.root + ":" if self.root else ""
+            self.pagetreeCache, self.pathIndex = newTree(self.idPrefix)
+            self.prefetcher = None
+            if int(self.prefetch) > 0:
+                self.prefetcher = Prefetcher(self._prefetchPages,
+                                             int(self.prefetch),
+                                             int(self.prefetch_pages),
+                                             int(self.prefetch_bytes),
+                                             self.batch_size)
+            if self.refresh not in ("changes", "full", "lazy"):
+                raise ValueError("unknown refresh mode {0}".format(self.refresh))
+            if self.startup not in ("wait", "lazy"):
+                raise ValueError("unknown startup mode {0}".format(self.startup))
+            self.media = bool(int(self.media))
+            self.media_extensions = frozenset(extension.strip().lower().lstrip(".")
+                                              for extension in self.media_extensions.split(",")
+                                              if extension.strip())
+            self._kernelOptions()
+            self.diskCache = None
+            self.mediaCache = None
+            self.mediaCacheTemp = None
+            if self.media:
+                self.mediaCache = self._openMediaCache()
+            if self.cache_dir:
+                self.diskCache = self._openDiskCache()
+                self._restorePagetree()
+            if self.startup == "wait":
+                self._checkVersion()
+                #no empty mount if the login or the listing fails
+                if self.refresh == "lazy":
+                    self._loadNamespace("/", cache=False, raiseErrors=True)
+                else:
+                    self._refreshPagetree(time.time(), raiseErrors=True)
         except Exception,e:
             self.log.error( "Exception {0}: {1}".format(e.__class__.__name__,str(e)))
             raise RuntimeError(e)
 
+    def _kernelOptions(self):
+        """
+        passes the kernel cache options on to libfuse, the parser keeps
+        options registered with add_option() to itself
+        """
+        for option in ("attr_timeout", "entry_timeout", "negative_timeout"):
+            setattr(self, option, float(getattr(self, option)))
+            self.fuse_args.add(option, str(getattr(self, option)))
+        if int(self.kernel_cache):
+            self.fuse_args.add("kernel_cache")
+        self.fuse_args.add("use_ino") #stable inodes of dokuwikitree
+
+    def _checkVersion(self): #rethrows DokuWikiXMLRPCError
+        batch = self.dokuwiki.batch()
+        batch.dokuwiki_version()
+        batch.rpc_version_supported()
+        version, rpcVersion = batch.execute()
+        for result in (version, rpcVersion):
+            if isinstance(result, DokuWikiXMLRPCError):
+                raise result
+        self.log.info("DokuWiki Version: %s RPC Version: %s", version, rpcVersion)
+
+    def _warmup(self):
+        """
+        startup=lazy: checks the wiki and validates or loads the page tree
+        while the first FUSE calls are already served
+        """
+        try:
+            self._checkVersion()
+        except Exception,e:
+            self.log.error( "Exception {0}: {1}".format(e.__class__.__name__,str(e)))
+        self._pagetree(cache=False)
+
+    def _refreshLoop(self):
+        """
+        refreshes the page tree every refresh_interval seconds so that
+        lookups find a fresh snapshot without waiting for the wiki
+        """
+        while not self.refreshStop.is_set():
+            self.refreshStop.wait(self.refresh_interval)
+            if not self.refreshStop.is_set():
+                self._refreshPagetree(time.time())
+
+    def _cacheName(self):
+        #one cache per wiki and user, acls may hide pages from others
+        return hashlib.sha1("{0}\0{1}\0{2}".format(self.url, self.username, self.root)).hexdigest()[:16]
+
+    def _openDiskCache(self):
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir, 0700)
+        return DiskCache(os.path.join(os.path.abspath(self.cache_dir), self._cacheName() + ".sqlite"))
+
+    def _openMediaCache(self):
+        if self.cache_dir:
+            path = os.path.join(os.path.abspath(self.cache_dir), self._cacheName() + "-media")
+        else:
+            path = self.mediaCacheTemp = tempfile.mkdtemp(prefix="dokuwikifs-media-")
+        return MediaCache(path, int(self.media_cache_size))
+
+    def _restorePagetree(self):
+        """
+        loads the page tree stored by an earlier mount, the following
+        refresh only has to fetch the changes made since then
+        """
+        pages, media, lastChange, syncTime = self.diskCache.loadPages()
+        if lastChange is None or self.refresh != "changes" \
+                or syncTime + self.changes_window < time.time():
+            return
+        tree, index = newTree(self.idPrefix)
+        for pageId, size, mtime in pages:
+            self._insertPage(pageId, size, mtime, tree, index)
+        if self.media:
+            for mediaId, size, mtime in media:
+                self._insertMedia(mediaId, size, mtime, tree, index)
+        with self.treeLock:
+            self.pagetreeCache = tree
+            self.pathIndex = index
+            self.listings.clear()
+            self.lastChange = lastChange
+            self.pagetreeSyncTime = syncTime
+            self.diskCacheSyncTime = syncTime
+            if self.startup == "lazy":
+                #serve the snapshot while _warmup() validates it
+                self.pagetreeCacheTime = time.time()
+        self.log.info("restored %d pages from %s", len(pages), self.diskCache.path)
+
+    def _pathToId(self, path):
+        return self.idPrefix + path[1:].replace("/", ":")
+
+    def _idToPath(self, pageId):
+        """
+        returns the FUSE path of a page id, None for pages outside of the mounted root
+        """
+        if not pageId.startswith(self.idPrefix):
+            return None
+        return "/" + pageId[len(self.idPrefix):].replace(":", "/")
+
     def _pagelist(self,cache=True): #rethrows DokuWikiXMLRPCError
-        return self.dokuwiki.pagelist("")
+        """
+        yields the pages of the mounted root while the listing is received
+        """
+        return self.dokuwiki.iter_pagelist(self.root)
 
     def _pagetree(self,cache=True):
-        if self.pagetreeCacheTime + self.pagetreeCacheTimeout < time.time() \
-                or not cache:
+        """
+        returns the current page tree snapshot. It is kept fresh by
+        _refreshLoop(), a refresh is only done here if it is requested
+        (cache=False) or the snapshot is older than max_stale.
+        """
+        if self.refresh == "lazy":
+            with self.treeLock:
+                #namespaces are listed on demand by _loadNamespace()
+                if not cache:
+                    self.nsLoadTime.clear()
+                return self.pagetreeCache
+
+        now = time.time()
+        if not cache:
+            self._refreshPagetree(now)
+        elif self.pagetreeSyncTime + self.max_stale < now \
+                and self.pagetreeCacheTime + self.refresh_interval < now:
+            self.log.info("_pagetree: tree is %.0fs old, refreshing in the foreground", now - self.pagetreeSyncTime)
+            #a refresh finishing meanwhile in the background will do as well
+            self._refreshPagetree(self.pagetreeSyncTime)
+        return self.pagetreeCache
+
+    def _refreshPagetree(self, after, raiseErrors=False):
+        """
+        brings the page tree up to date unless a refresh started after the
+        time after has already succeeded. The wiki is queried without
+        holding treeLock, lookups keep using the old snapshot until the new
+        one is swapped in. On errors the old snapshot stays in place, the
+        error is logged or with raiseErrors=True rethrown.
+        """
+        with self.refreshLock:
+            if self.pagetreeSyncTime > after:
+                return
+            start = time.time()
             try:
-                for page in self._pagelist(cache=cache):
-                    path = page['id'].split(":")
-                    myRoot = self.pagetreeCache
-                    for pathElem in path:
-                        if path[-1] == pathElem: #last path element -> filename
-                            myRoot[pathElem] = DokuPage("/"+("/".join(path)))
-                            myRoot[pathElem].id = page['id']
-                            myRoot[pathElem].st_size = page['size']
-                            myRoot[pathElem].st_atime = page['mtime']
-                            myRoot[pathElem].st_mtime = page['mtime']
-                            myRoot[pathElem].st_ctime = page['mtime']
-                        else:
-                            if not myRoot.has_key(pathElem):
-                                myRoot[pathElem] = dict()
-                            myRoot = myRoot[pathElem]
-            except DokuWikiXMLRPCError,e:
-                self.log.error(str(e))
-                return dict()
+                if self.refresh == "changes" and self.lastChange is not None \
+                        and self.pagetreeSyncTime + self.changes_window > start:
+                    self._applyRecentChanges()
+                else:
+                    self._loadPagetree()
+            except Exception,e:
+                self.refreshFailures += 1
+                self.log.error("_refreshPagetree: {0}: {1}".format(e.__class__.__name__, str(e)))
+                if raiseErrors:
+                    raise
+                return
             finally:
                 self.pagetreeCacheTime = time.time()
+            self.pagetreeSyncTime = start
+            self.refreshCount += 1
+            self.refreshDuration = time.time() - start
+            self.refreshMaxDuration = max(self.refreshMaxDuration, self.refreshDuration)
+            self.log.debug("_refreshPagetree: took %.3fs", self.refreshDuration)
 
-        return self.pagetreeCache
+    def refreshStats(self):
+        """
+        refresh metrics; age is the time since the start of the last
+        successful refresh, None before the first one
+        """
+        return {'refreshes': self.refreshCount,
+                'failures': self.refreshFailures,
+                'lastDuration': self.refreshDuration,
+                'maxDuration': self.refreshMaxDuration,
+                'age': time.time() - self.pagetreeSyncTime if self.pagetreeSyncTime else None,
+                'interval': self.refresh_interval,
+                'maxStale': self.max_stale}
+
+    def _loadNamespace(self, nsPath, cache=True, raiseErrors=False):
+        """
+        refresh=lazy: (re)lists the namespace at nsPath if its listing is
+        older than ns_timeout. Listing one level deeper than the namespace
+        itself reveals its sub-namespaces, except those that only contain
+        further namespaces. Those are listed when a path below them is
+        looked up, so nsPath need not be in the tree yet; the wiki has no
+        call listing namespaces themselves. Sub-namespaces missing from the
+        listing are kept until they are listed themselves and turn out empty.
+        The wiki is queried without holding treeLock, only the listing is
+        merged under it. Errors are logged or with raiseErrors=True rethrown.
+        """
+        with self.treeLock:
+            if cache and self.nsLoadTime.get(nsPath, 0) + self.ns_timeout > time.time():
+                return
+            if isinstance(lookup(self.pathIndex, nsPath), DokuPage):
+                return
+        nsId = self._pathToId(nsPath).rstrip(":")
+        depth = len(nsId.split(":")) + 2 if nsId else 2 #absolute, counted from the wiki root
+        batch = self.dokuwiki.batch()
+        batch.pagelist(nsId, {'depth': depth})
+        if self.media:
+            batch.list_files(nsId)
+        try:
+            results = batch.execute()
+            for result in results:
+                if isinstance(result, DokuWikiXMLRPCError):
+                    raise result
+            pages = results[0]
+            media = results[1] if self.media else list()
+        except DokuWikiXMLRPCError,e:
+            self.log.error("_loadNamespace({0}): {1}".format(nsPath, str(e)))
+            with self.treeLock:
+                self.nsLoadTime[nsPath] = time.time()
+            if raiseErrors:
+                raise
+            return
 
+        with self.treeLock:
+            if len(self.nsLoadTime) >= nsLoadTimeSize:
+                self.nsLoadTime.clear()
+            self.nsLoadTime[nsPath] = time.time()
+            prefix = nsPath.rstrip("/") + "/"
+            seen = set()
+            for page in pages:
+                entry = self._insertPage(page['id'], page['size'], page['mtime'])
+                if entry and entry.path.startswith(prefix):
+                    seen.add(entry.path[len(prefix):].split("/")[0])
+            for item in media:
+                entry = self._insertMedia(item['id'], item['size'], self._mediaTime(item))
+                if entry:
+                    seen.add(entry.name)
+            node = self.pathIndex.get(nsPath)
+            if not isinstance(node, dict): #no namespace or removed during the listing
+                return
+            for name, child in node.items():
+                if name not in seen and not isinstance(child, dict):
+                    self._dropEntry(prefix + name, node.pop(name))
+            if not node and nsPath != "/":
+                parentPath, name = nsPath.rsplit("/", 1)
+                parent = self.pathIndex.get(parentPath or "/")
+                if isinstance(parent, dict) and parent.get(name) is node:
+                    self._dropEntry(nsPath, parent.pop(name))
+            self.log.debug("_loadNamespace(%s): %d pages", nsPath, len(pages))
+            changedPaths = [path for path in self.kernelRevisions if path.startswith(prefix)]
+        self._invalidate(changedPaths)
+
+    def _keepKernelCache(self, entry):
+        """
+        True if the kernel may keep the cached content of entry on open,
+        i.e. the revision is the same as on the last open
+        """
+        revision = (entry.st_mtime, entry.st_size)
+        with self.treeLock:
+            keep = self.kernelRevisions.get(entry.path) == revision
+            if not keep and len(self.kernelRevisions) >= kernelRevisionsSize:
+                self.kernelRevisions.clear()
+            self.kernelRevisions[entry.path] = revision
+        return keep
+
+    def _forgetKernelCache(self, path):
+        """the next open drops the kernel cache, e.g. after a save"""
+        with self.treeLock:
+            self.kernelRevisions.pop(path, None)
+
+    def _invalidate(self, paths):
+        """
+        drops the kernel cache of those paths whose revision differs from
+        the one handed out on their last open. Invalidate() is best effort,
+        libfuse 2 does not implement it; the next open drops the cache anyway
+        because keep_cache is not set then.
+        """
+        stale = list()
+        with self.treeLock:
+            for path in paths:
+                revision = self.kernelRevisions.get(path)
+                if revision is None:
+                    continue
+                entry = lookup(self.pathIndex, path)
+                if not isinstance(entry, DokuPage) or (entry.st_mtime, entry.st_size) != revision:
+                    del self.kernelRevisions[path]
+                    stale.append(path)
+        if not self.mounted:
+            return
+        for path in stale: #without treeLock, the kernel may call back into getattr
+            try:
+                result = self.Invalidate(path)
+            except Exception,e:
+                result = e
+            self.log.debug("_invalidate(%s): %s", path, result)
+
+    def _dropEntry(self, path, entry):
+        """
+        removes the index entries of an entry already unlinked from its namespace
+        """
+        self.listings.clear()
+        self.pathIndex.pop(path, None)
+        if isinstance(entry, dict):
+            self.nsLoadTime.pop(path, None)
+            for name, child in entry.items():
+                self._dropEntry(path + "/" + name, child)
+        elif isinstance(entry, DokuMedia):
+            self.mediaCache.discard(entry.id)
+        else:
+            self._discardContent(entry.id)
+
+    def _loadAncestors(self, path, cache=True):
+        """
+        refresh=lazy: makes sure the namespaces leading to path are listed
+        """
+        self._loadNamespace("/", cache)
+        nsPath = ""
+        for pathElem in path[1:].split("/")[:-1]:
+            nsPath += "/" + pathElem
+            self._loadNamespace(nsPath, cache)
+
+    def _loadPagetree(self): #rethrows DokuWikiXMLRPCError
+        """
+        replaces the page tree with a full listing of the wiki
+        """
+        tree, index = newTree(self.idPrefix)
+        lastChange = 0
+        rows = list() if self.diskCache else None
+        for page in self._pagelist():
+            if self._insertPage(page['id'], page['size'], page['mtime'], tree, index) \
+                    and rows is not None:
+                rows.append((page['id'], page['size'], page['mtime']))
+            lastChange = max(lastChange, page['mtime'])
+        mediaRows = list()
+        if self.media:
+            for item in self.dokuwiki.list_files(self.root, recursive=True):
+                mtime = self._mediaTime(item)
+                if self._insertMedia(item['id'], item['size'], mtime, tree, index):
+                    mediaRows.append((item['id'], item['size'], mtime))
+                lastChange = max(lastChange, mtime)
+
+        with self.treeLock:
+            #pages created by open handles exist only locally until released
+            for files in self.openFiles.values():
+                for handle in files:
+                    if handle.dirty:
+                        self._insertEntry(handle.entry.path, handle.entry, tree, index)
+            self.pagetreeCache = tree
+            self.pathIndex = index
+            self.listings.clear()
+            self.lastChange = lastChange
+            changedPaths = self.kernelRevisions.keys()
+        self._invalidate(changedPaths)
+        if self.diskCache:
+            self.diskCacheSyncTime = time.time()
+            self.diskCache.savePages(rows, mediaRows, lastChange, self.diskCacheSyncTime)
+        self.log.debug("_loadPagetree: full listing, last change %s", lastChange)
+
+    def _applyRecentChanges(self): #rethrows DokuWikiXMLRPCError
+        """
+        updates the page tree with the changes made since the last refresh
+        """
+        try:
+            changes = self.dokuwiki.recent_changes(self.lastChange)
+        except DokuWikiXMLRPCError,e:
+            if e.page_id != NO_CHANGES_FAULT:
+                raise
+            changes = list()
+        mediaChanges = self._recentMediaChanges()
+
+        hot = dict() #changed pages somebody has read recently
+        changed = dict()
+        removed = set()
+        changedMedia = dict()
+        removedMedia = set()
+        with self.treeLock: #lookups see the whole delta or nothing of it
+            self._applyChanges(changes, hot, changed, removed)
+            self._applyMediaChanges(mediaChanges, changedMedia, removedMedia)
+        self.log.debug("_applyRecentChanges: %d changes, %d media changes, last change %s",
+                       len(changes), len(mediaChanges), self.lastChange)
+        self._invalidate(self._idToPath(itemId) for itemId in
+                         itertools.chain(changed, removed, changedMedia, removedMedia))
+        #without changes the sync time is only stored now and then, it
+        #decides whether the next mount may start from the stored tree
+        now = time.time()
+        if self.diskCache and (changed or removed or changedMedia or removedMedia
+                               or self.diskCacheSyncTime + self.max_stale < now):
+            self.diskCacheSyncTime = now
+            self.diskCache.updatePages(changed.values(), removed,
+                                       changedMedia.values(), removedMedia,
+                                       self.lastChange, now)
+        self._fetchPages(hot.values())
+
+    def _recentMediaChanges(self): #rethrows DokuWikiXMLRPCError
+        """
+        returns the attachment changes since the last refresh. Wikis
+        without wiki.getRecentMediaChanges only update attachments on
+        full listings.
+        """
+        if not self.media:
+            return list()
+        try:
+            return self.dokuwiki.recent_media_changes(self.lastChange)
+        except DokuWikiXMLRPCError,e:
+            if e.page_id != NO_CHANGES_FAULT:
+                self.log.error("_recentMediaChanges: {0}".format(str(e)))
+            return list()
+
+    def _treeEntry(self, itemId, media=False):
+        """
+        returns the page (or with media=True the attachment) itemId of the
+        page tree or None
+        """
+        path = self._idToPath(itemId)
+        entry = lookup(self.pathIndex, path) if path is not None else None
+        if isinstance(entry, DokuPage) and isinstance(entry, DokuMedia) == media:
+            return entry
+        return None
+
+    def _applyChanges(self, changes, hot, changed, removed):
+        """
+        applies the changes of getRecentChanges, which reports the newest
+        change again on every call; changes the tree already shows are skipped
+        """
+        for change in sorted(changes, key=lambda change: change['version']):
+            self.lastChange = max(self.lastChange, change['version'])
+            entry = self._treeEntry(change['name'])
+            #dokuwiki has no empty pages, deleted ones are reported without size
+            if change.get('type') == 'D' or not change['size']:
+                if entry is None:
+                    continue
+                self._removePage(change['name'])
+                hot.pop(change['name'], None)
+                changed.pop(change['name'], None)
+                removed.add(change['name'])
+            else:
+                if entry is not None and (entry.st_mtime, entry.st_size) == (change['version'], change['size']):
+                    continue
+                #an older revision was read, the current one is not cached yet
+                wasCached = self.pageCache.contains(change['name']) \
+                    and not self.pageCache.contains(change['name'], change['version'])
+                page = self._insertPage(change['name'], change['size'], change['version'])
+                if page is None: #outside of the mounted root
+                    continue
+                if wasCached:
+                    hot[page.id] = page
+                changed[page.id] = (page.id, page.st_size, page.st_mtime)
+                removed.discard(page.id)
+
+    def _applyMediaChanges(self, changes, changed, removed):
+        for change in sorted(changes, key=lambda change: change['version']):
+            self.lastChange = max(self.lastChange, change['version'])
+            entry = self._treeEntry(change['name'], media=True)
+            #unlike pages attachments may be empty
+            if change.get('type') == 'D' or change['size'] is False:
+                if entry is None:
+                    continue
+                self._removePage(change['name'], media=True)
+                changed.pop(change['name'], None)
+                removed.add(change['name'])
+            else:
+                if entry is not None and (entry.st_mtime, entry.st_size) == (change['version'], change['size']):
+                    continue
+                entry = self._insertMedia(change['name'], change['size'], change['version'])
+                if entry is None: #outside of the mounted root
+                    continue
+                changed[entry.id] = (entry.id, entry.st_size, entry.st_mtime)
+                removed.discard(entry.id)
+
+    def _mediaTime(self, item):
+        """
+        mtime of a wiki.getAttachments entry, older wikis only send lastModified
+        """
+        if 'mtime' in item:
+            return item['mtime']
+        return calendar.timegm(time.strptime(str(item['lastModified']), "%Y%m%dT%H:%M:%S"))
+
+    def _insertMedia(self, mediaId, size, mtime, tree=None, index=None):
+        """
+        adds or updates an attachment in the page tree, like _insertPage()
+        """
+        path = self._idToPath(mediaId)
+        if path is None:
+            return None
+        return self._insertEntry(path, DokuMedia(size, mtime), tree, index)
+
+    def _insertPage(self, pageId, size, mtime, tree=None, index=None):
+        """
+        adds or updates a page in the page tree and returns its DokuPage,
+        pages outside of the mounted root are ignored and None is returned
+        """
+        path = self._idToPath(pageId)
+        if path is None:
+            return None
+        return self._insertEntry(path, DokuPage(size, mtime), tree, index)
+
+    def _insertEntry(self, path, page, tree=None, index=None):
+        with self.treeLock:
+            if tree is None:
+                self.listings.clear()
+            return insertEntry(self.pagetreeCache if tree is None else tree,
+                               self.pathIndex if index is None else index,
+                               path, page)
+
+    def _removePage(self, pageId, media=False):
+        """
+        removes a page (or with media=True an attachment) from the page
+        tree, together with namespaces it leaves empty
+        """
+        fusePath = self._idToPath(pageId)
+        if fusePath is None:
+            return
+        path = fusePath[1:].split("/")
+        with self.treeLock:
+            parents = [self.pagetreeCache]
+            for pathElem in path[:-1]:
+                child = parents[-1].get(pathElem)
+                if not isinstance(child, dict):
+                    return
+                parents.append(child)
+            entry = parents[-1].get(path[-1])
+            if not isinstance(entry, DokuPage) or isinstance(entry, DokuMedia) != media:
+                return
+            del parents[-1][path[-1]]
+            self.listings.clear()
+            for depth in range(len(path) - 1, 0, -1):
+                if parents[depth]:
+                    break
+                del parents[depth - 1][path[depth - 1]]
+                self.pathIndex.pop("/" + "/".join(path[:depth]), None)
+        if media:
+            self.mediaCache.discard(pageId)
+        else:
+            self._discardContent(pageId)
 
     def _findPageTreeEntry(self, pathIn, cache=True):
         if not checkpath(pathIn):
             self.log.error("_findPageTreeEntry: Invalid path {0}".format(pathIn))
             return None
 
-        path = pathIn[1:].split("/") #remove preceding and split by "/"
-        root = self._pagetree(cache=cache)
-        for pathElem in path:
-            if pathElem == '':
-                #happens in root directory, pathIn == "/"
-                continue
-            if root.has_key(pathElem):
-                root = root[pathElem]
-            else:
-                self.log.debug( "_findPageTreeEntry({0},cache={1}): Path not found".format(pathIn,cache) )
-                return None
-        return root
+        if self.refresh == "lazy":
+            self._loadAncestors(pathIn, cache)
+            with self.treeLock:
+                entry = lookup(self.pathIndex, pathIn)
+            if entry is None and pathIn != "/":
+                #a namespace holding only namespaces is not in its parent's listing
+                self._loadNamespace(pathIn, cache)
+                with self.treeLock:
+                    entry = lookup(self.pathIndex, pathIn)
+        else:
+            self._pagetree(cache=cache)
+            entry = lookup(self.pathIndex, pathIn)
+        if entry is None:
+            self.log.debug("_findPageTreeEntry(%s, cache=%s): Path not found", pathIn, cache)
+        return entry
+
+    def _pagecontent(self, entry): #rethrows DokuWikiXMLRPCError
+        """
+        returns the utf-8 encoded content of the page revision described by entry
+        """
+        buf = self._cachedContent(entry)
+        if buf is None:
+            buf = self.dokuwiki.page(entry.id).encode("utf-8")
+            self._storeContent(entry, buf)
+        return buf
+
+    def _cachedContent(self, entry):
+        buf = self.pageCache.get(entry.id, entry.st_mtime)
+        if buf is None and self.diskCache and entry.st_mtime:
+            buf = self.diskCache.get(entry.id, entry.st_mtime)
+            if buf is not None:
+                self.pageCache.put(entry.id, entry.st_mtime, buf)
+        return buf
+
+    def _storeContent(self, entry, buf):
+        if not entry.st_mtime: #unknown revision (fresh mknod) is not cacheable
+            return
+        self.pageCache.put(entry.id, entry.st_mtime, buf)
+        if self.diskCache:
+            self.diskCache.put(entry.id, entry.st_mtime, buf)
+
+    def _discardContent(self, pageId):
+        self.pageCache.discard(pageId)
+        if self.diskCache:
+            self.diskCache.discard(pageId)
+
+    def _mediaContent(self, entry): #rethrows DokuWikiXMLRPCError
+        """
+        returns a read-only mmap of the attachment revision described by entry
+        """
+        return self.mediaCache.open(entry.id, entry.st_mtime,
+                                    lambda: self.dokuwiki.get_file(entry.id))
+
+    def _fetchPages(self, entries):
+        """
+        loads the content of the given pages into the page cache,
+        batch_size pages per system.multicall request
+        """
+        entries = list(entries)
+        for start in range(0, len(entries), self.batch_size):
+            chunk = entries[start:start+self.batch_size]
+            batch = self.dokuwiki.batch()
+            for entry in chunk:
+                batch.page(entry.id)
+            try:
+                results = batch.execute()
+            except DokuWikiXMLRPCError,e:
+                self.log.error("_fetchPages: {0}".format(str(e)))
+                return
+            for entry, result in zip(chunk, results):
+                if isinstance(result, DokuWikiXMLRPCError):
+                    self.log.debug("_fetchPages(%s): %s", entry.id, result)
+                else:
+                    self._storeContent(entry, result.encode("utf-8"))
+
+    def _prefetchPages(self, entries):
+        self._fetchPages([entry for entry in entries
+                          if self._cachedContent(entry) is None])
 
     def fsinit(self):
         self.log.info("fsinit")
         os.chdir("/")
+        #threads are started here, after fuse has daemonized
+        self.locks.start()
+        if self.prefetcher:
+            self.prefetcher.start()
+        if self.refresh != "lazy":
+            thread = threading.Thread(target=self._refreshLoop, name="refresh")
+            thread.daemon = True
+            thread.start()
+        if self.startup == "lazy":
+            #without snapshot the first lookup loads the tree itself or
+            #waits for the warmup holding the tree lock
+            thread = threading.Thread(target=self._warmup, name="warmup")
+            thread.daemon = True
+            thread.start()
+
+    def fsdestroy(self):
+        self.log.info("fsdestroy")
+        self.log.info("transport: %s", self.dokuwiki.transport_stats())
+        self.refreshStop.set()
+        if self.prefetcher:
+            self.prefetcher.stop()
+        self.locks.stop()
+        if self.diskCache:
+            self.diskCache.close()
+        if self.mediaCacheTemp:
+            shutil.rmtree(self.mediaCacheTemp, True)
         
+    def stats(self):
+        """
+        counters of the FUSE operations, XML-RPC calls, caches and the page tree
+        """
+        def withHitRate(stats):
+            lookups = stats['hits'] + stats['misses']
+            stats['hitRate'] = float(stats['hits']) / lookups if lookups else None
+            return stats
+
+        result = self.metrics.snapshot()
+        result['transport'] = self.dokuwiki.transport_stats()
+        result['pageCache'] = withHitRate(self.pageCache.stats())
+        if self.versions:
+            result['versionCache'] = withHitRate(self.versionCache.stats())
+        if self.html:
+            result['htmlCache'] = withHitRate(self.htmlCache.stats())
+        if self.diskCache:
+            result['diskCache'] = withHitRate(self.diskCache.stats())
+        if self.mediaCache:
+            result['mediaCache'] = withHitRate(self.mediaCache.stats())
+        if self.prefetcher:
+            result['prefetch'] = self.prefetcher.stats()
+        result['locks'] = self.locks.stats()
+        result['refresh'] = self.refreshStats()
+        with self.treeLock:
+            result['tree'] = {'namespaces': len(self.pathIndex),
+                              'openFiles': sum(len(files) for files in self.openFiles.values())}
+        return result
+
+    def _statsStat(self, path):
+        """
+        stat of the virtual stats directory and file. The file content is
+        produced on open and read with direct_io, so it has no fixed size.
+        """
+        t = fuse.Stat()
+        t.st_ino = inode(path)
+        if path == STATS_DIR:
+            t.st_mode = stat.S_IFDIR | 0555
+            t.st_nlink = 2
+        else:
+            t.st_mode = stat.S_IFREG | 0444
+            t.st_nlink = 1
+        t.st_mtime = t.st_ctime = t.st_atime = int(time.time())
+        return t
+
+    def _isVersionPath(self, path):
+        return self.versions and (path == VERSIONS_DIR or path.startswith(VERSIONS_DIR + "/"))
+
+    def _resolveVersion(self, path): #rethrows DokuWikiXMLRPCError
+        """
+        returns (entry, revision) for a path below VERSIONS_DIR: a namespace
+        or a page directory with revision None, or a page and the revision
+        of a revision file. (None, None) if the path does not exist.
+        """
+        treePath = path[len(VERSIONS_DIR):] or "/"
+        entry = self._findPageTreeEntry(treePath)
+        if isinstance(entry, dict) or (entry is not None and not isinstance(entry, DokuMedia)):
+            return entry, None
+        parentPath, name = treePath.rsplit("/", 1)
+        if entry is not None or not name.isdigit():
+            return None, None
+        page = self._findPageTreeEntry(parentPath or "/")
+        if not isinstance(page, DokuPage) or isinstance(page, DokuMedia) \
+                or int(name) not in self._pageVersions(page):
+            return None, None
+        return page, int(name)
+
+    def _pageVersions(self, page): #rethrows DokuWikiXMLRPCError
+        """
+        sorted revisions of a page including the current one. The list
+        only grows with new revisions, it is fetched again once the page
+        has a new mtime.
+        """
+        cached = self.versionLists.get(page.id)
+        if cached is not None and cached[0] == page.st_mtime:
+            return cached[1]
+        revisions = set([page.st_mtime]) if page.st_mtime else set()
+        offset = 0
+        while True:
+            batch = self.dokuwiki.page_versions(page.id, offset)
+            new = [version['version'] for version in batch if version['version'] not in revisions]
+            if not new:
+                break
+            revisions.update(new)
+            offset += len(batch)
+        revisions = sorted(revisions)
+        if len(self.versionLists) >= versionListsSize:
+            self.versionLists.clear()
+        self.versionLists[page.id] = (page.st_mtime, revisions)
+        return revisions
+
+    def _versionContent(self, page, revision): #rethrows DokuWikiXMLRPCError
+        """
+        returns the utf-8 encoded content of an old revision. Revisions
+        are immutable, once fetched they are served from versionCache
+        until evicted. A missing revision is fetched together with the
+        following missing ones of the page, as ls -l stats them in order.
+        The current revision is read with getPage and only kept if
+        getPageInfo, sent after it in the same multicall, still reports it.
+        """
+        buf = self.versionCache.get(page.id, revision)
+        if buf is not None:
+            return buf
+        revisions = self._pageVersions(page)
+        missing = [r for r in revisions[revisions.index(revision):]
+                   if not self.versionCache.contains(page.id, r)][:self.batch_size]
+        if revision not in missing:
+            missing.insert(0, revision)
+        batch = self.dokuwiki.batch()
+        for r in missing:
+            if r == page.st_mtime:
+                batch.page(page.id)
+            else:
+                batch.page(page.id, r)
+        if page.st_mtime in missing:
+            batch.page_info(page.id)
+        results = batch.execute()
+        if page.st_mtime in missing:
+            info = results.pop()
+            if isinstance(info, DokuWikiXMLRPCError) or info.get('version') != page.st_mtime:
+                #changed since the last tree refresh, getPage returned a newer text
+                index = missing.index(page.st_mtime)
+                del missing[index], results[index]
+        for r, result in zip(missing, results):
+            if isinstance(result, DokuWikiXMLRPCError):
+                if r == revision:
+                    raise result
+                continue
+            content = result.encode("utf-8")
+            self.versionCache.put(page.id, r, content)
+            if r == revision:
+                buf = content
+        if buf is None: #the revision was current at the last refresh, now it is an old one
+            buf = self.dokuwiki.page(page.id, revision).encode("utf-8")
+            self.versionCache.put(page.id, revision, buf)
+        return buf
+
+    def _versionStat(self, path, entry, revision): #rethrows DokuWikiXMLRPCError
+        t = fuse.Stat()
+        t.st_ino = inode(path)
+        if revision is None:
+            t.st_mode = stat.S_IFDIR | 0555
+            t.st_nlink = 2
+            t.st_mtime = t.st_ctime = t.st_atime = getattr(entry, 'st_mtime', 0)
+        else:
+            t.st_mode = stat.S_IFREG | 0444
+            t.st_nlink = 1
+            t.st_size = len(self._versionContent(entry, revision))
+            t.st_mtime = t.st_ctime = t.st_atime = revision
+        return t
+
+    def _versionsGetattr(self, path):
+        try:
+            entry, revision = self._resolveVersion(path)
+            if entry is None:
+                return -errno.ENOENT
+            return self._versionStat(path, entry, revision)
+        except DokuWikiXMLRPCError,e:
+            self.log.error("getattr({0}): {1}".format(path, str(e)))
+            return -errno.EIO
+
+    def _versionsReaddir(self, path):
+        try:
+            entry, revision = self._resolveVersion(path)
+            if isinstance(entry, dict):
+                if self.refresh == "lazy":
+                    self._loadNamespace(path[len(VERSIONS_DIR):] or "/")
+                for name, child in entry.items():
+                    if checkpath(name) and not isinstance(child, DokuMedia):
+                        yield fuse.Direntry(name, type=stat.S_IFDIR,
+                                            ino=inode(path.rstrip("/") + "/" + name))
+            elif entry is not None and revision is None:
+                for r in self._pageVersions(entry):
+                    yield fuse.Direntry(str(r), type=stat.S_IFREG,
+                                        ino=inode("{0}/{1}".format(path, r)))
+            else:
+                self.log.error("readdir({0}): not a directory".format(path))
+        except DokuWikiXMLRPCError,e:
+            self.log.error("readdir({0}): {1}".format(path, str(e)))
+
+    def _isHtmlPath(self, path):
+        return self.html and (path == HTML_DIR or path.startswith(HTML_DIR + "/"))
+
+    def _isReadOnlyPath(self, path):
+        return self._isVersionPath(path) or self._isHtmlPath(path)
+
+    def _resolveHtml(self, path):
+        """
+        returns the namespace or the page of a path below HTML_DIR or None
+        """
+        treePath = path[len(HTML_DIR):] or "/"
+        if treePath.endswith(HTML_SUFFIX):
+            entry = self._findPageTreeEntry(treePath[:-len(HTML_SUFFIX)])
+            if isinstance(entry, DokuPage) and not isinstance(entry, DokuMedia):
+                return entry
+        entry = self._findPageTreeEntry(treePath)
+        if isinstance(entry, dict):
+            return entry
+        return None
+
+    def _htmlContent(self, page): #rethrows DokuWikiXMLRPCError
+        """
+        returns the page rendered by the wiki, utf-8 encoded. Renders are
+        cached by page id and mtime, so a change of the page in the tree
+        makes it stale without asking the wiki. A missing page is rendered
+        in one system.multicall together with the following pages of its
+        namespace that are missing too.
+        """
+        buf = self.htmlCache.get(page.id, page.st_mtime)
+        if buf is not None:
+            return buf
+        with self.treeLock:
+            if page.parent.get(page.name) is page:
+                siblings = sorted(page.parent.items())
+            else: #removed from the tree by a refresh
+                siblings = None
+        pages = [page]
+        if siblings is not None:
+            start = [name for name, child in siblings].index(page.name)
+            pages += [child for name, child in siblings[start+1:]
+                      if isinstance(child, DokuPage) and not isinstance(child, DokuMedia)
+                      and child.st_mtime and checkpath(name)
+                      and not self.htmlCache.contains(child.id, child.st_mtime)]
+            pages = pages[:self.batch_size]
+        batch = self.dokuwiki.batch()
+        for entry in pages:
+            batch.page_html(entry.id)
+        for entry, result in zip(pages, batch.execute()):
+            if isinstance(result, DokuWikiXMLRPCError):
+                if entry is page:
+                    raise result
+                continue
+            content = result.encode("utf-8")
+            if entry.st_mtime: #unknown revision (fresh mknod) is not cacheable
+                self.htmlCache.put(entry.id, entry.st_mtime, content)
+            if entry is page:
+                buf = content
+        return buf
+
+    def _htmlStat(self, path, entry, content=None):
+        t = fuse.Stat()
+        t.st_ino = inode(path)
+        if isinstance(entry, dict):
+            t.st_mode = stat.S_IFDIR | 0555
+            t.st_nlink = 2
+        else:
+            t.st_mode = stat.S_IFREG | 0444
+            t.st_nlink = 1
+            t.st_size = len(content)
+            t.st_mtime = t.st_ctime = t.st_atime = entry.st_mtime
+        return t
+
+    def _htmlGetattr(self, path):
+        entry = self._resolveHtml(path)
+        if entry is None:
+            return -errno.ENOENT
+        try:
+            content = None if isinstance(entry, dict) else self._htmlContent(entry)
+        except DokuWikiXMLRPCError,e:
+            self.log.error("getattr({0}): {1}".format(path, str(e)))
+            return -errno.EIO
+        return self._htmlStat(path, entry, content)
+
+    def _htmlReaddir(self, path):
+        entry = self._resolveHtml(path)
+        if not isinstance(entry, dict):
+            self.log.error("readdir({0}): not a directory".format(path))
+            return
+        if self.refresh == "lazy":
+            self._loadNamespace(path[len(HTML_DIR):] or "/")
+        prefix = path.rstrip("/") + "/"
+        for name, child in entry.items():
+            if not checkpath(name) or isinstance(child, DokuMedia):
+                continue
+            if isinstance(child, dict):
+                yield fuse.Direntry(name, type=stat.S_IFDIR, ino=inode(prefix + name))
+            else:
+                yield fuse.Direntry(name + HTML_SUFFIX, type=stat.S_IFREG,
+                                    ino=inode(prefix + name + HTML_SUFFIX))
+
+    def _readOnlyFile(self, path):
+        """
+        returns content and stat of a file below VERSIONS_DIR or HTML_DIR
+        for DokuFile, raises IOError
+        """
+        try:
+            if self._isHtmlPath(path):
+                entry = self._resolveHtml(path)
+                if entry is None:
+                    raise IOError(errno.ENOENT, path)
+                if isinstance(entry, dict):
+                    raise IOError(errno.EISDIR, path)
+                content = self._htmlContent(entry)
+                return content, self._htmlStat(path, entry, content)
+            entry, revision = self._resolveVersion(path)
+            if entry is None:
+                raise IOError(errno.ENOENT, path)
+            if revision is None:
+                raise IOError(errno.EISDIR, path)
+            return self._versionContent(entry, revision), self._versionStat(path, entry, revision)
+        except DokuWikiXMLRPCError,e:
+            self.log.error("open({0}): {1}".format(path, str(e)))
+            raise IOError(errno.EIO, path)
+
+    @instrumented(fsMetrics)
     def statfs(self):
-        self.log.info("statfs()")
+        self.log.debug("statfs()")
         statfs = fuse.StatVfs()
         statfs.f_bsize = 1                    #preferred size of file blocks, in bytes
         statfs.f_frsize = 1                   #fragment size
@@ -159,75 +1224,159 @@ Try -d to see whats going on
         statfs.f_favail = statfs.f_ffree      #free inodes for unprivileged users
         return statfs
 
+    def _listedEntry(self, path):
+        """
+        looks path up in the snapshot of its namespace taken by a readdir()
+        less than entry_timeout seconds ago, so that the getattr() calls of
+        ls -l or find need no tree lookup or refresh check. Returns
+        (True, entry or None) or (False, None) if there is no snapshot.
+        """
+        nsPath, name = path.rsplit("/", 1)
+        if not name: #the root has no listed parent
+            return False, None
+        listing = self.listings.get(nsPath or "/")
+        if listing is None or listing[1] + self.entry_timeout < time.time():
+            return False, None
+        if not checkpath(path):
+            return True, None
+        return True, listing[0].get(name)
+
+    def _rememberListing(self, path, namespace):
+        with self.treeLock:
+            #the tree may have changed while the namespace was listed
+            if lookup(self.pathIndex, path) is not namespace:
+                return
+            if len(self.listings) >= listingsSize:
+                self.listings.clear()
+            self.listings[path] = (namespace, time.time())
+
+    def _dirStat(self, namespace):
+        t = fuse.Stat()
+        t.st_ino = namespace.st_ino
+        t.st_mode = stat.S_IFDIR | 0777
+        t.st_blksize = 0
+        t.st_nlink = 2
+        t.st_size = 0
+        return t
+
+    @instrumented(fsMetrics)
     def getattr(self, path):
-        entry = self._findPageTreeEntry(path)
+        if path in (STATS_DIR, STATS_PATH):
+            return self._statsStat(path)
+        if self._isVersionPath(path):
+            return self._versionsGetattr(path)
+        if self._isHtmlPath(path):
+            return self._htmlGetattr(path)
+        listed, entry = self._listedEntry(path)
+        if not listed:
+            entry = self._findPageTreeEntry(path)
         if not entry:
-            self.log.error( "getattr({0}): not found".format(path) )
+            self.log.debug("getattr(%s): not found", path)
             return -errno.ENOENT
         elif isinstance(entry, dict):
-            self.log.info( "getattr({0}): dir with {1} entries".format(path, len(entry)) )
-            t = fuse.Stat()
-            t.st_mode = stat.S_IFDIR | 0777
-            t.st_blksize = 0
-            t.st_nlink = 2
-            t.st_size = 0
-            return t
+            self.log.debug("getattr(%s): dir with %d entries", path, len(entry))
+            return self._dirStat(entry)
         elif isinstance(entry, DokuPage):
-            self.log.info( "getattr({0}): {1}".format(path, entry) )
-            return entry
-
-    def open ( self, path, flags ):
-        self.log.info( "open({0}, {1})".format(path,flags) )
-        entry = self._findPageTreeEntry(path)
-        if not entry:
-            self.log.info( "open({0}, {1}): file not found".format(path,flags) )
-            return -errno.ENOSYS
-        elif isinstance(entry, dict):
-            self.log.info( "open({0}, {1}): -EISDIR is a directory".format(path,flags) )
-            return -errno.EISDIR
-        else:
-            return None #success
+            self.log.debug("getattr(%s): %r", path, entry)
+            return entry.stat()
 
+    @instrumented(fsMetrics)
     def readdir(self, path, offset):
-        self.log.info( "readdir({0}, {1})".format(path, offset) )
-        yield fuse.Direntry(".")
-        yield fuse.Direntry("..")
+        """
+        lists a namespace with type and inode of every entry. The snapshot
+        also answers the getattr() calls for the entries that usually follow.
+        """
+        self.log.debug("readdir(%s, %d)", path, offset)
+        yield fuse.Direntry(".", type=stat.S_IFDIR)
+        yield fuse.Direntry("..", type=stat.S_IFDIR)
+        if path == STATS_DIR:
+            yield fuse.Direntry(os.path.basename(STATS_PATH), type=stat.S_IFREG, ino=inode(STATS_PATH))
+            return
+        if self._isVersionPath(path):
+            for entry in self._versionsReaddir(path):
+                yield entry
+            return
+        if self._isHtmlPath(path):
+            for entry in self._htmlReaddir(path):
+                yield entry
+            return
+        if path == "/":
+            yield fuse.Direntry(os.path.basename(STATS_DIR), type=stat.S_IFDIR, ino=inode(STATS_DIR))
         entry = self._findPageTreeEntry(path)
+        if self.refresh == "lazy" and isinstance(entry, dict):
+            self._loadNamespace(path)
+            entry = self._findPageTreeEntry(path) #the listing may have replaced it
         if entry and isinstance(entry, dict):
-            for name in entry.keys():
+            if self.entry_timeout > 0:
+                self._rememberListing(path, entry)
+            children = entry.items()
+            if self.prefetcher:
+                self.prefetcher.enqueue(
+                    child for name, child in children
+                    if isinstance(child, DokuPage) and not isinstance(child, DokuMedia)
+                        and child.st_mtime and checkpath(name)
+                        and not self.pageCache.contains(child.id, child.st_mtime))
+            for name, child in children:
                 if checkpath(name):
-                    yield fuse.Direntry( name )
+                    if isinstance(child, dict):
+                        yield fuse.Direntry(name, type=stat.S_IFDIR, ino=child.st_ino)
+                    else:
+                        yield fuse.Direntry(name, type=stat.S_IFREG, ino=child.st_ino)
                 else:
-                    self.log.debug("readdir: skip {0}".format(name))
+                    self.log.debug("readdir: skip %s", name)
         else:
             self.log.error("readdir({0},{1}): not a directory".format(path,offset))
 
+    @instrumented(fsMetrics)
     def chmod(self, path, mode):
-        self.log.info( "EOPNOTSUPP chmod({0},{1})".format(path,mode) )
+        self.log.info("EOPNOTSUPP chmod(%s,%s)", path, mode)
         return -errno.EOPNOTSUPP
  
+    @instrumented(fsMetrics)
     def chown(self, path, user, group):
-        self.log.info( "EOPNOTSUPP chown({0},{1},{2})".format(path,user,group) )
+        self.log.info("EOPNOTSUPP chown(%s,%s,%s)", path, user, group)
         return -errno.EOPNOTSUPP
  
+    @instrumented(fsMetrics)
     def truncate(self, path, length):
-        self.log.info( "truncate({0},{1})".format(path, length) )
+        self.log.info("truncate(%s,%s)", path, length)
+        if self._isReadOnlyPath(path):
+            return -errno.EROFS
+        with self.treeLock:
+            handles = [f for f in self.openFiles.get(path, ()) if f.writable]
+        if handles:
+            #truncate(2) issued right after open(O_TRUNC): let the open handles
+            #push the result together with the following writes
+            for handle in handles:
+                handle.ftruncate(length)
+            return 0
+
+        entry = self._findPageTreeEntry(path)
+        if not entry or not isinstance(entry, DokuPage):
+            return -errno.ENOENT
+        if isinstance(entry, DokuMedia):
+            try:
+                data = self._mediaContent(entry)[:length]
+            except (DokuWikiXMLRPCError, EnvironmentError),e:
+                self.log.error(str(e))
+                return -errno.EIO
+            return self._saveMedia(entry, StringIO(data), len(data))
         if length == 0:
             self.log.info("Emulate truncate to zero by writing placeholder")
-            self.write(path, "%truncated%", 0)
+            buf = "%truncated%"
         else:
-            entry = self._findPageTreeEntry(path)
-            if not entry or not isinstance(entry, DokuPage):
-                return -errno.ENOENT
-
-            buf = self.dokuwiki.page(entry.id)[:length]
-            if self.write(path, buf, 0) != len(buf):
+            try:
+                buf = self._pagecontent(entry)[:length]
+            except DokuWikiXMLRPCError,e:
+                self.log.error(str(e))
                 return -errno.EIO
-            else:
-                return 0
+        return self._savePage(entry, buf, "truncate() by uid=TODO")
 
+    @instrumented(fsMetrics)
     def rmdir(self, path):
-        self.log.info( "rmdir({0})".format(path) )
+        self.log.info("rmdir(%s)", path)
+        if self._isReadOnlyPath(path):
+            return -errno.EROFS
         entry = self._findPageTreeEntry(path)
         if not entry:
             return -errno.ENOENT
@@ -239,36 +1388,41 @@ Try -d to see whats going on
         else:
             return -errno.ENOTEMPTY
 
+    @instrumented(fsMetrics)
     def link(self, path):
-        self.log.info( "EOPNOTSUPP link({0})".format(path) )
+        self.log.info("EOPNOTSUPP link(%s)", path)
         return -errno.EOPNOTSUPP
 
+    @instrumented(fsMetrics)
     def rename(self, path, newpath):
-        self.log.info( "EOPNOTSUPP rename({0},{1})".format(path,newpath) )
+        self.log.info("EOPNOTSUPP rename(%s,%s)", path, newpath)
         return -errno.EOPNOTSUPP
 
+    @instrumented(fsMetrics)
     def unlink(self, path):
-        self.log.info( "unlink({0})".format(path) )
+        self.log.info("unlink(%s)", path)
+        if self._isReadOnlyPath(path):
+            return -errno.EROFS
         entry = self._findPageTreeEntry(path)
-        if isinstance(entry, DokuPage):
-           return self.write(path, "", 0)
+        if isinstance(entry, DokuMedia):
+            try:
+                self.dokuwiki.delete_file(entry.id)
+            except DokuWikiXMLRPCError,e:
+                self.log.error("delete_file({0}): {1}".format(entry.id, str(e)))
+                return -errno.EIO
+            self._removePage(entry.id, media=True)
+            return 0
+        elif isinstance(entry, DokuPage):
+           return self._savePage(entry, "", "unlink() by uid=TODO")
         else:
-            self.log.info("EOPNOTSUPP unlink for {0}".format(entry))
+            self.log.info("EOPNOTSUPP unlink for %s", entry)
             return -errno.EOPNOTSUPP
 
-    def read(self, path, length, offset):
-        self.log.info( "read({0},{1},{2})".format(path, length, offset) )
-        entry = self._findPageTreeEntry(path)
-        if not entry or not isinstance(entry, DokuPage):
-            self.log.error( "read({0},{1},{2}): No Such file or directory: {3}".format(path, length, offset, entry) )
-            return -errno.ENOENT
-
-        buf = self.dokuwiki.page(entry.id)
-        result = buf[offset:length+offset]
-        return result.encode("utf-8")
-
+    @instrumented(fsMetrics)
     def mknod(self, path, mode, rdev):
-        self.log.info("mknod: %s (mode %s, rdev %s)" % (path, oct(mode), rdev))
+        self.log.info("mknod: %s (mode %o, rdev %s)", path, mode, rdev)
+        if self._isReadOnlyPath(path):
+            return -errno.EROFS
         if rdev != 0:
             self.log.error("mknod rdev != 0 not supported")
             return -errno.EOPNOTSUPP
@@ -285,62 +1439,328 @@ Try -d to see whats going on
             self.log.error("mknod: Invalid path {0}".format(path))
             return -errno.EIO
 
+        pageid = self._pathToId(path)
+        if self._isMediaPath(path):
+            try:
+                self.dokuwiki.put_file(pageid, "", True)
+                self._pagetree(cache=False)
+                return 0
+            except DokuWikiXMLRPCError,e:
+                return -errno.EIO
+
         #put page
-        pageid = path.replace("/", ":")
         try:
             self.dokuwiki.put_page(pageid, "placeholder", "created by mknod() call", minor=True)
+            self._discardContent(pageid)
             self._pagetree(cache=False) #reread tree
             return 0 #success
         except DokuWikiXMLRPCError,e:
             return -errno.EIO
 
-    def write(self, path, buf, offset):
-        self.log.info( "write({0}, len(buf)={1}, {2})".format(path, len(buf), offset) )
-        entry = self._findPageTreeEntry(path)
-        if not entry or not isinstance(entry, DokuPage):
-            return -errno.ENOENT
+    def _isMediaPath(self, path):
+        """
+        True if a new file at path is to be created as attachment, i.e.
+        its extension is one the wiki accepts for uploads. Page ids may
+        contain dots as well, e.g. notes.1.2.
+        """
+        name = os.path.basename(path)
+        return self.media and "." in name \
+            and name.rsplit(".", 1)[1].lower() in self.media_extensions
 
-        # Lock page to prevent race-conditions
+    def _saveMedia(self, entry, fileobj, size):
+        """
+        uploads size bytes from fileobj as new revision of the attachment,
+        returns 0 or -errno
+        """
         try:
-            lockResult = self.dokuwiki.set_locks({'lock': [ entry.id ], 'unlock':list()})
-            if not entry.id in lockResult['locked']:
-                self.log.error( "Failed to lock page {0}. lockResult was {1}".format(entry.id, lockResult) )
-                return -errno.EIO
-        except DokuWikiXMLRPCError,e:
-            self.log.error(str(e))
+            self.dokuwiki.put_file_stream(entry.id, fileobj, size, overwrite=True)
+        except (DokuWikiXMLRPCError,Exception),e:
+            self.log.error("put_file_stream({0}): {1}".format(entry.id, str(e)))
             return -errno.EIO
+        self.mediaCache.discard(entry.id) #tree still reports the old mtime
+        self._forgetKernelCache(entry.path)
+        entry.st_size = size
+        return 0
+
+    def _lock(self, entry):
+        """
+        takes a lease on the lock of the page to prevent race-conditions.
+        The lock manager locks the page in the background if the lease
+        lasts, put_page checks the locks of other users itself.
+        Every lease ends with _unlock().
+        """
+        self.locks.acquire(entry.id)
+
+    def _unlock(self, entry):
+        """ends a lease, the lock manager unlocks the page with its next batch"""
+        self.locks.release(entry.id)
 
+    def _savePage(self, entry, buf, summary):
+        """
+        stores buf as new revision of the page, returns 0 or -errno.
+        put_page locks the page for the save and drops the lock afterwards.
+        """
         try:
-            if offset == 0:
-                self.dokuwiki.put_page(entry.id, buf, "write() by uid=TODO", minor=False)
-                if len(buf) == 0: #writing a empty dw-page is like removing it
-                    self._pagetree(cache=False)
-            else:
-                #writing with offset, fetch current page
-                old_buf = self.read(path, offset, 0) #use offset as length parameter
-                self.dokuwiki.put_page(entry.id,
-                                       old_buf + buf,
-                                       "subsequent write(offset={0}) by uid=TODO".format(offset),
-                                       minor=False)
+            self.dokuwiki.put_page(entry.id, buf, summary, minor=False)
         except (DokuWikiXMLRPCError,Exception),e:
-            self.log.error("write({0}, offset={1}): {2}".format(path, offset, str(e)))
-            # remove pagelock if write failed
-            if len(buf) > 0:
-                try:
-                    lockResult = self.dokuwiki.set_locks({'lock':list(), 'unlock': [ entry.id ]})
-                    if not entry.id in lockResult['unlocked']:
-                        self.log.error( "Failed to UN-lock page {0}. lockResult was {1}".format(entry.id, lockResult) )
-                        return -errno.EIO
-                except DokuWikiXMLRPCError,e2:
-                    self.log.error(str(e2))
-                    return -errno.EIO
-        
-        return len(buf)
+            self.log.error("put_page({0}): {1}".format(entry.id, str(e)))
+            return -errno.EIO
+
+        self.locks.saved(entry.id)
+        self._discardContent(entry.id) #tree still reports the old mtime
+        self._forgetKernelCache(entry.path)
+        entry.st_size = len(buf)
+        if len(buf) == 0: #writing a empty dw-page is like removing it
+            self._pagetree(cache=False)
+        return 0
+
+    def main(self, *args, **kw):
+        DokuFile.fs = self
+        self.file_class = DokuFile
+        self.mounted = True
+        return fuse.Fuse.main(self, *args, **kw)
+
+
+class DokuFile(object):
+    """
+    Open page or attachment. Writes are collected in a spooled buffer and
+    sent to the wiki as one new revision on flush(), fsync() or release().
+    Attachments are uploaded straight from the buffer.
+    """
+    fs = None #the mounted DokuFS, set in DokuFS.main()
+    spoolMaxMemory = 1024*1024
+
+    @instrumented(fileMetrics, "open")
+    def __init__(self, path, flags, *mode):
+        self.fs.log.debug("open(%s, %d)", path, flags)
+        self.path = path
+        self.writable = bool(flags & (os.O_WRONLY | os.O_RDWR))
+        self.buf = None #spooled copy of the page once it is modified
+        self.dirty = False
+        self.locked = False
+        self.placeholder = None
+        self.created = False #inserted into the tree by open(), not on the wiki until stored
+        self.media = None #mmap of an attachment once it is read
+        self.virtual = None #content of the stats file, an old revision or a rendered page
+
+        if path == STATS_PATH:
+            if self.writable:
+                raise IOError(errno.EACCES, path)
+            self.virtual = json.dumps(self.fs.stats(), indent=1, sort_keys=True) + "\n"
+            self.virtualStat = self.fs._statsStat(path)
+            self.virtualStat.st_size = len(self.virtual)
+            self.direct_io = True
+            return
+        if self.fs._isReadOnlyPath(path):
+            if self.writable:
+                raise IOError(errno.EROFS, path)
+            self.virtual, self.virtualStat = self.fs._readOnlyFile(path)
+            self.keep_cache = self.fs._isVersionPath(path) #revisions never change
+            return
+        self.lock = threading.RLock() #FUSE worker threads may share a handle
+
+        self.entry = self.fs._findPageTreeEntry(path)
+        if self.entry is None:
+            if not flags & os.O_CREAT:
+                raise IOError(errno.ENOENT, path)
+            if not checkpath(path):
+                self.fs.log.error("create: Invalid path {0}".format(path))
+                raise IOError(errno.EIO, path)
+            if self.fs._isMediaPath(path):
+                self.entry = self.fs._insertMedia(self.fs._pathToId(path), 0, 0)
+            else:
+                self.entry = self.fs._insertPage(self.fs._pathToId(path), 0, 0)
+                self.placeholder = "placeholder"
+            self.created = True
+            self._setContent("")
+        elif isinstance(self.entry, dict):
+            self.fs.log.info("open(%s, %d): -EISDIR is a directory", path, flags)
+            raise IOError(errno.EISDIR, path)
+        elif flags & os.O_CREAT and flags & os.O_EXCL:
+            raise IOError(errno.EEXIST, path)
+        elif flags & os.O_TRUNC:
+            self.placeholder = "%truncated%"
+            self._setContent("")
+        else:
+            #unchanged revision: reads are served from the kernel page cache
+            self.keep_cache = self.fs._keepKernelCache(self.entry)
+
+        with self.fs.treeLock:
+            self.fs.openFiles.setdefault(path, []).append(self)
+
+    def _setContent(self, content):
+        self.buf = tempfile.SpooledTemporaryFile(max_size=self.spoolMaxMemory)
+        self.buf.write(content)
+        self.dirty = True
+
+    def _modify(self, load=True):
+        """
+        prepares the buffer for modification, raises IOError
+        """
+        if self.buf is None and not load:
+            self._setContent("")
+        elif self.buf is None and isinstance(self.entry, DokuMedia):
+            self._setContent("")
+            try:
+                media = self.fs._mediaContent(self.entry)
+            except (DokuWikiXMLRPCError, EnvironmentError),e:
+                self.fs.log.error(str(e))
+                raise IOError(errno.EIO, self.path)
+            for offset in range(0, len(media), self.spoolMaxMemory):
+                self.buf.write(media[offset:offset+self.spoolMaxMemory])
+            if media:
+                media.close()
+        elif self.buf is None:
+            try:
+                self._setContent(self.fs._pagecontent(self.entry))
+            except DokuWikiXMLRPCError,e:
+                self.fs.log.error(str(e))
+                raise IOError(errno.EIO, self.path)
+        if not self.locked and not isinstance(self.entry, DokuMedia):
+            self.fs._lock(self.entry)
+            self.locked = True
+        self.dirty = True
+
+    def _size(self):
+        self.buf.seek(0, os.SEEK_END)
+        return self.buf.tell()
+
+    @instrumented(fileMetrics)
+    def read(self, length, offset):
+        self.fs.log.debug("read(%s, %d, %d)", self.path, length, offset)
+        if self.virtual is not None:
+            return self.virtual[offset:offset+length]
+        with self.lock:
+            if self.buf is not None:
+                self.buf.seek(offset)
+                return self.buf.read(length)
+            if isinstance(self.entry, DokuMedia):
+                return self._readMedia(length, offset)
+            try:
+                return self.fs._pagecontent(self.entry)[offset:length+offset]
+            except DokuWikiXMLRPCError,e:
+                self.fs.log.error(str(e))
+                return -errno.EIO
+
+    def _readMedia(self, length, offset):
+        if self.media is None:
+            try:
+                self.media = self.fs._mediaContent(self.entry)
+            except (DokuWikiXMLRPCError, EnvironmentError),e:
+                self.fs.log.error("read({0}): {1}".format(self.path, str(e)))
+                return -errno.EIO
+        return self.media[offset:offset+length]
+
+    @instrumented(fileMetrics, dataArg=True)
+    def write(self, buf, offset):
+        self.fs.log.debug("write(%s, len(buf)=%d, %d)", self.path, len(buf), offset)
+        with self.lock:
+            self._modify()
+            self.buf.seek(offset)
+            self.buf.write(buf)
+            return len(buf)
+
+    @instrumented(fileMetrics)
+    def ftruncate(self, length):
+        self.fs.log.debug("ftruncate(%s, %d)", self.path, length)
+        with self.lock:
+            self._modify(load=length > 0)
+            media = isinstance(self.entry, DokuMedia)
+            if length > self._size():
+                if media: #page text is not extended by NUL bytes, like truncate()
+                    self.buf.seek(length - 1)
+                    self.buf.write("\0")
+            else:
+                self.buf.seek(length)
+                self.buf.truncate()
+                if length == 0 and not media: #an empty page would be deleted
+                    self.placeholder = self.placeholder or "%truncated%"
+            return 0
+
+    @instrumented(fileMetrics)
+    def fgetattr(self):
+        if self.virtual is not None:
+            return self.virtualStat
+        with self.lock:
+            st = self.entry.stat()
+            if self.buf is not None:
+                st.st_size = self._size()
+            return st
+
+    def _push(self):
+        if not self.dirty:
+            return 0
+        if isinstance(self.entry, DokuMedia):
+            result = self.fs._saveMedia(self.entry, self.buf, self._size())
+            if result == 0:
+                self.dirty = False
+                self.created = False
+            return result
+        if self.locked and self.fs.locks.refused(self.entry.id):
+            self.fs.log.error("push({0}): the page is locked by another user".format(self.path))
+            return -errno.EIO
+
+        self.buf.seek(0)
+        content = self.buf.read() or self.placeholder or ""
+        result = self.fs._savePage(self.entry, content, "write() by uid=TODO")
+        if result == 0:
+            self.dirty = False
+            self.created = False
+            self.placeholder = None
+            if self.locked: #put_page released the lock, the next write takes a new lease
+                self.fs._unlock(self.entry)
+                self.locked = False
+        return result
+
+    @instrumented(fileMetrics)
+    def flush(self):
+        if self.virtual is not None:
+            return 0
+        with self.lock:
+            return self._push()
+
+    @instrumented(fileMetrics)
+    def fsync(self, isfsyncfile):
+        if self.virtual is not None:
+            return 0
+        with self.lock:
+            return self._push()
+
+    @instrumented(fileMetrics)
+    def release(self, flags):
+        self.fs.log.debug("release(%s)", self.path)
+        if self.virtual is not None:
+            return 0
+        with self.lock:
+            result = self._push()
+            if self.locked:
+                self.fs._unlock(self.entry)
+            if self.buf is not None:
+                self.buf.close()
+            if self.media:
+                self.media.close()
+            with self.fs.treeLock:
+                self.fs.openFiles[self.path].remove(self)
+                if not self.fs.openFiles[self.path]:
+                    del self.fs.openFiles[self.path]
+                    if result != 0 and self.created \
+                            and lookup(self.fs.pathIndex, self.path) is self.entry:
+                        #created by open() but never stored on the wiki
+                        self.fs._removePage(self.entry.id, isinstance(self.entry, DokuMedia))
+            return result
 
  
-dokuFS = DokuFS(version="%prog " + fuse.__version__,
-                usage=DokuFS.usage)
-dokuFS.parse(values=dokuFS, errex=1)
-dokuFS.connect()
-dokuFS.multithreaded = False
-dokuFS.main()
+def main():
+    dokuFS = DokuFS(version="%prog " + fuse.__version__,
+                    usage=DokuFS.usage,
+                    dash_s_do='setsingle') # -s disables the multithreaded mode
+    dokuFS.parse(values=dokuFS, errex=1)
+    level = logging.getLevelName(str(dokuFS.loglevel).upper())
+    if not isinstance(level, int):
+        raise SystemExit("unknown loglevel {0}".format(dokuFS.loglevel))
+    logging.basicConfig(level=level)
+    dokuFS.connect()
+    dokuFS.main()
+
+if __name__ == '__main__':
+    main()
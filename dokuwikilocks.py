@@ -0,0 +1,213 @@
+"""Page lock leases of the DokuWiki FUSE driver."""
+
+import time
+import logging
+import threading
+
+#seconds a new lease waits before its lock is sent. wiki.putPage checks
+#and takes the lock itself, so files saved and closed within this time
+#never need a setLocks call
+LOCK_DELAY = 1.0
+
+#seconds a released lock waits for other unlocks or locks to share a setLocks call
+UNLOCK_DELAY = 1.0
+
+
+class LockManager(object):
+    """Leases on DokuWiki page locks, shared by all open files.
+
+    acquire() takes a lease on the lock of a page without waiting for the
+    wiki, release() ends it. The lock itself is only sent once a lease is
+    LOCK_DELAY old, so that other editors see a file kept open for
+    writing, e.g. by an editor; a quick open-write-close needs none.
+    Locks and unlocks go out in batches through setLocks(locks), which
+    takes the argument of dokuwiki.setLocks. Unlocks wait up to
+    UNLOCK_DELAY for company and are dropped if the page is acquired again
+    meanwhile. Locks still leased are renewed every renewInterval seconds,
+    before the wiki lets them expire (locktime, 15 minutes by default).
+    A lock the wiki refuses is reported once by refused(). All methods are
+    thread-safe.
+    """
+
+    def __init__(self, setLocks, renewInterval):
+        if renewInterval <= max(LOCK_DELAY, UNLOCK_DELAY):
+            raise ValueError("lock renew interval must exceed {0}s".format(max(LOCK_DELAY, UNLOCK_DELAY)))
+        self.log = logging.getLogger("LockManager")
+        self.renewInterval = renewInterval
+        self.calls = 0
+        self.locked = 0
+        self.lockFailures = 0
+        self.renewed = 0
+        self.unlocked = 0
+        self.skippedLocks = 0
+        self.cancelledUnlocks = 0
+        self._setLocks = setLocks
+        self._leases = dict() #page id -> number of holders
+        self._held = dict() #page id -> time the wiki last confirmed the lock
+        self._lockQueue = dict() #page id -> time the lock was requested
+        self._unlockQueue = dict() #page id -> time of the release
+        self._refused = set() #leased page ids whose lock the wiki refused
+        self._sending = False
+        self._condition = threading.Condition()
+        self._stopped = False
+
+    def start(self):
+        thread = threading.Thread(target=self._run, name="locks")
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        """ends all leases and unlocks their pages on the wiki"""
+        with self._condition:
+            self._stopped = True
+            while self._sending:
+                self._condition.wait()
+            for pageId in self._held:
+                self._unlockQueue.setdefault(pageId, 0)
+            self._leases.clear()
+            self._lockQueue.clear()
+            self._refused.clear()
+            if self._unlockQueue:
+                self._send(renew=False)
+            self._condition.notify_all()
+
+    def acquire(self, pageId):
+        """takes a lease on the lock of the page, the lock is sent later"""
+        with self._condition:
+            self._leases[pageId] = self._leases.get(pageId, 0) + 1
+            if pageId in self._held:
+                if self._unlockQueue.pop(pageId, None) is not None:
+                    self.cancelledUnlocks += 1
+            elif pageId not in self._lockQueue:
+                self._lockQueue[pageId] = time.time()
+
+    def release(self, pageId):
+        """ends a lease, the page is unlocked with the next batch"""
+        with self._condition:
+            if not self._endLease(pageId):
+                return
+            if self._lockQueue.pop(pageId, None) is not None:
+                self.skippedLocks += 1
+            if pageId in self._held:
+                self._unlockQueue[pageId] = time.time()
+
+    def saved(self, pageId):
+        """
+        wiki.putPage dropped the lock of the page on the wiki. Pages still
+        leased are locked again.
+        """
+        with self._condition:
+            self._held.pop(pageId, None)
+            self._unlockQueue.pop(pageId, None)
+            if pageId in self._leases and pageId not in self._lockQueue:
+                self._lockQueue[pageId] = time.time()
+
+    def refused(self, pageId):
+        """True once after the wiki refused the lock of a leased page"""
+        with self._condition:
+            if pageId in self._refused:
+                self._refused.remove(pageId)
+                return True
+            return False
+
+    def _endLease(self, pageId):
+        """returns True if it was the last lease on the page"""
+        count = self._leases.get(pageId, 0) - 1
+        if count > 0:
+            self._leases[pageId] = count
+            return False
+        self._leases.pop(pageId, None)
+        self._refused.discard(pageId)
+        return True
+
+    def _send(self, renew=True):
+        """
+        sends the due locks, the queued unlocks and the due renewals in one
+        setLocks call. Called with _condition held, which is released
+        during the call.
+        """
+        now = time.time()
+        requests = set(pageId for pageId, requested in self._lockQueue.items()
+                       if requested + LOCK_DELAY <= now)
+        for pageId in requests:
+            del self._lockQueue[pageId]
+        renewals = set()
+        if renew:
+            renewals = set(pageId for pageId, confirmed in self._held.items()
+                           if confirmed + self.renewInterval <= now
+                           and pageId not in self._unlockQueue)
+        lock = sorted(renewals.union(requests))
+        unlock = sorted(self._unlockQueue)
+        self._unlockQueue.clear()
+        for pageId in unlock:
+            self._held.pop(pageId, None)
+        if not lock and not unlock:
+            return
+
+        self._sending = True
+        self._condition.release()
+        try:
+            result = self._setLocks({'lock': lock, 'unlock': unlock})
+        except Exception,e:
+            self.log.error("setLocks of {0} locks and {1} unlocks failed: {2}".format(
+                len(lock), len(unlock), str(e)))
+            result = None
+        finally:
+            self._condition.acquire()
+            self._sending = False
+        self.calls += 1
+
+        locked = set(result['locked']) if result else set()
+        now = time.time()
+        for pageId in lock:
+            if pageId in locked:
+                if pageId in renewals:
+                    self.renewed += 1
+                else:
+                    self.locked += 1
+                self._held[pageId] = now
+                if pageId not in self._leases: #released while the call was running
+                    self._unlockQueue[pageId] = now
+            elif not result: #retried with the next batch
+                if pageId in requests and pageId in self._leases:
+                    self._lockQueue.setdefault(pageId, now)
+            elif pageId in renewals:
+                self._held.pop(pageId, None)
+                self.log.error("lock of {0} lost".format(pageId))
+            else:
+                self.lockFailures += 1
+                if pageId in self._leases:
+                    self._refused.add(pageId)
+                    self.log.error("lock of {0} refused by the wiki".format(pageId))
+        if result:
+            #failed unlocks expire on the wiki by themselves
+            self.unlocked += len(result['unlocked'])
+        self._condition.notify_all()
+
+    def _due(self, now):
+        if any(requested + LOCK_DELAY <= now for requested in self._lockQueue.values()):
+            return True
+        if any(released + UNLOCK_DELAY <= now for released in self._unlockQueue.values()):
+            return True
+        return any(confirmed + self.renewInterval <= now
+                   for pageId, confirmed in self._held.items()
+                   if pageId not in self._unlockQueue)
+
+    def _run(self):
+        with self._condition:
+            while not self._stopped:
+                self._condition.wait(min(LOCK_DELAY, UNLOCK_DELAY))
+                if not self._stopped and not self._sending and self._due(time.time()):
+                    self._send()
+
+    def stats(self):
+        with self._condition:
+            return {'leases': sum(self._leases.values()),
+                    'held': len(self._held),
+                    'calls': self.calls,
+                    'locked': self.locked,
+                    'lockFailures': self.lockFailures,
+                    'renewed': self.renewed,
+                    'unlocked': self.unlocked,
+                    'skippedLocks': self.skippedLocks,
+                    'cancelledUnlocks': self.cancelledUnlocks}
@@ -0,0 +1,124 @@
+"""Operation metrics of the DokuWiki FUSE driver."""
+
+import time
+import bisect
+import inspect
+import threading
+import functools
+
+#upper bounds of the latency histogram buckets in milliseconds
+LATENCY_BUCKETS = (0.1, 0.5, 1, 5, 10, 50, 100, 500, 1000, 5000)
+
+
+class OperationStats(object):
+    """Call count, errors, transferred bytes and latency histogram of one operation"""
+    __slots__ = ('calls', 'errors', 'seconds', 'maxSeconds', 'bytesIn', 'bytesOut', 'histogram')
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.maxSeconds = 0.0
+        self.bytesIn = 0
+        self.bytesOut = 0
+        self.histogram = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def add(self, seconds, bytesIn, bytesOut, error):
+        self.calls += 1
+        if error:
+            self.errors += 1
+        self.seconds += seconds
+        self.maxSeconds = max(self.maxSeconds, seconds)
+        self.bytesIn += bytesIn
+        self.bytesOut += bytesOut
+        self.histogram[bisect.bisect_left(LATENCY_BUCKETS, seconds * 1000)] += 1
+
+    def snapshot(self):
+        buckets = ["<={0}ms".format(bound) for bound in LATENCY_BUCKETS] + [">{0}ms".format(LATENCY_BUCKETS[-1])]
+        return {'calls': self.calls,
+                'errors': self.errors,
+                'avgMs': self.seconds * 1000 / self.calls if self.calls else 0,
+                'maxMs': self.maxSeconds * 1000,
+                'bytesIn': self.bytesIn,
+                'bytesOut': self.bytesOut,
+                'latency': dict((bucket, count) for bucket, count in zip(buckets, self.histogram) if count)}
+
+
+class Metrics(object):
+    """
+    Per operation statistics, grouped by kind ("fuse" operations and
+    "xmlrpc" methods). All methods are thread-safe.
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self._kinds = dict() #kind -> name -> OperationStats
+        self._lock = threading.Lock()
+
+    def record(self, kind, name, seconds, bytesIn=0, bytesOut=0, error=False):
+        with self._lock:
+            operations = self._kinds.setdefault(kind, dict())
+            stats = operations.get(name)
+            if stats is None:
+                stats = operations[name] = OperationStats()
+            stats.add(seconds, bytesIn, bytesOut, error)
+
+    def xmlrpc(self, method, seconds, bytesOut, bytesIn, error):
+        """observer for the DokuWikiClient transport"""
+        self.record("xmlrpc", method, seconds, bytesIn, bytesOut, error)
+
+    def snapshot(self):
+        with self._lock:
+            result = dict((kind, dict((name, stats.snapshot()) for name, stats in operations.items()))
+                          for kind, operations in self._kinds.items())
+        result['uptime'] = time.time() - self.started
+        return result
+
+
+def _failed(result):
+    return isinstance(result, int) and not isinstance(result, bool) and result < 0
+
+
+def _size(data):
+    return len(data) if isinstance(data, str) else 0
+
+
+def instrumented(metrics, name=None, dataArg=False):
+    """
+    decorator recording the calls of a FUSE operation. metrics(self) returns
+    the Metrics of the instance. A negative errno result or an exception
+    counts as error. str results count as bytes out, with dataArg=True the
+    first argument (a write buffer) as bytes in. Generators are timed until
+    they are exhausted.
+    """
+    def decorate(function):
+        operation = name or function.__name__
+
+        if inspect.isgeneratorfunction(function):
+            @functools.wraps(function)
+            def generatorWrapper(self, *args):
+                start = time.time()
+                error = True
+                try:
+                    for item in function(self, *args):
+                        yield item
+                    error = False
+                finally:
+                    metrics(self).record("fuse", operation, time.time() - start, error=error)
+            return generatorWrapper
+
+        @functools.wraps(function)
+        def wrapper(self, *args):
+            start = time.time()
+            result = None
+            error = True
+            try:
+                result = function(self, *args)
+                error = _failed(result)
+                return result
+            finally:
+                metrics(self).record("fuse", operation, time.time() - start,
+                                     bytesIn=_size(args[0]) if dataArg else 0,
+                                     bytesOut=_size(result), error=error)
+        return wrapper
+    return decorate
@@ -0,0 +1,138 @@
+"""Compact in-memory page tree of the DokuWiki FUSE driver."""
+
+import stat
+import struct
+import hashlib
+import fuse
+
+#inode of the mount point, reserved by FUSE
+ROOT_INODE = 1
+
+
+def inode(key):
+    """
+    stable inode number for a page id, a namespace id ("a:b:") or a
+    virtual path. Derived from the sha1 of key, so it is the same on
+    every mount without a table; 63 bits make collisions negligible.
+    """
+    if isinstance(key, unicode):
+        key = key.encode("utf-8")
+    number = struct.unpack(">Q", hashlib.sha1(key).digest()[:8])[0] >> 1
+    return number if number > ROOT_INODE else number + 2
+
+
+class DokuNamespace(dict):
+    """
+    Namespace node, maps interned names to DokuNamespace and DokuPage
+    children. pathPrefix and idPrefix are the FUSE path and the page id
+    prefix shared by all children, e.g. "/a/b/" and "wiki:a:b:".
+    """
+    __slots__ = ('pathPrefix', 'idPrefix')
+
+    def __init__(self, pathPrefix="/", idPrefix=""):
+        dict.__init__(self)
+        self.pathPrefix = pathPrefix
+        self.idPrefix = idPrefix
+
+    @property
+    def st_ino(self):
+        if self.pathPrefix == "/":
+            return ROOT_INODE
+        return inode(self.idPrefix)
+
+
+class DokuPage(object):
+    """
+    Page node. Only name, namespace, size and mtime are stored, path, id
+    and the fuse.Stat handed to the kernel are derived on demand.
+    """
+    __slots__ = ('name', 'parent', 'st_size', 'st_mtime')
+    mode = stat.S_IFREG | 0666
+
+    def __init__(self, size, mtime):
+        self.name = None
+        self.parent = None #DokuNamespace, set by insertEntry()
+        self.st_size = size
+        self.st_mtime = mtime
+
+    @property
+    def path(self):
+        return self.parent.pathPrefix + self.name
+
+    @property
+    def id(self):
+        return self.parent.idPrefix + self.name
+
+    @property
+    def st_ino(self):
+        return inode(self.id)
+
+    def stat(self):
+        return fuse.Stat(st_mode=self.mode,
+                         st_ino=self.st_ino,
+                         st_dev=0,
+                         st_nlink=1,
+                         st_uid=0,
+                         st_gid=0,
+                         st_size=self.st_size,
+                         st_atime=self.st_mtime,
+                         st_mtime=self.st_mtime,
+                         st_ctime=self.st_mtime)
+
+    def __repr__(self):
+        return "DokuPage path={0} id={1}".format(self.path, self.id)
+
+
+class DokuMedia(DokuPage):
+    """Attachment node"""
+    __slots__ = ()
+
+    def __repr__(self):
+        return "DokuMedia path={0} id={1}".format(self.path, self.id)
+
+
+def newTree(idPrefix=""):
+    """returns an empty (tree, index) pair, index maps namespace paths to namespaces"""
+    tree = DokuNamespace("/", idPrefix)
+    return tree, {"/": tree}
+
+
+def insertEntry(tree, index, path, page):
+    """
+    stores page at path, creating missing namespaces on the way. Path
+    segments are interned, names like "start" repeat in every namespace.
+    A namespace wins over a page of the same name, a page over an
+    attachment.
+    """
+    pathElems = path[1:].split("/")
+    node = tree
+    for pathElem in pathElems[:-1]:
+        child = node.get(pathElem)
+        if not isinstance(child, DokuNamespace):
+            pathElem = intern(pathElem)
+            child = DokuNamespace(node.pathPrefix + pathElem + "/",
+                                  node.idPrefix + pathElem + ":")
+            node[pathElem] = child
+            index[child.pathPrefix[:-1]] = child
+        node = child
+    page.name = intern(pathElems[-1])
+    page.parent = node
+    existing = node.get(page.name)
+    if isinstance(existing, DokuNamespace):
+        return page
+    if isinstance(page, DokuMedia) and existing is not None \
+            and not isinstance(existing, DokuMedia):
+        return page
+    node[page.name] = page
+    return page
+
+
+def lookup(index, path):
+    """returns the DokuNamespace or DokuPage at path or None"""
+    entry = index.get(path)
+    if entry is None:
+        nsPath, name = path.rsplit("/", 1)
+        namespace = index.get(nsPath or "/")
+        if namespace is not None:
+            entry = namespace.get(name)
+    return entry
@@ -34,10 +34,15 @@ __author__  = 'Michael Klier <chi@chimeric.de>'
 
 
 import xmlrpclib
+import httplib
+import socket
+import errno
 import base64
+import threading
+import urllib
+import time
+import zlib
 from urllib import urlencode
-from urllib2 import urlopen
-from urllib2 import HTTPError
 
 
 class DokuWikiError(Exception):
@@ -80,6 +85,389 @@ class DokuWikiURLError(DokuWikiError):
                                                   self.message)
 
 
+class RequestNotSent(Exception):
+    """A request failed before the server could have processed it.
+
+    Raised by PersistentTransport when a reused connection turns out to
+    be closed by the server, the request may be sent again.
+
+    """
+
+    def __init__(self, error):
+        """Wrap the socket.error or httplib.HTTPException error."""
+        Exception.__init__(self, error)
+        self.error = error
+
+
+def _decode_file(data):
+    """Decode an attachment, sent as base64 value or base64 encoded string."""
+    if isinstance(data, xmlrpclib.Binary):
+        return data.data
+    return base64.b64decode(data)
+
+
+class StreamingBody(object):
+    """Request body produced in chunks instead of being held in memory.
+
+    chunks is a function returning a new iterator over the body each time
+    it is called, so the body can be sent again after a reconnect. length
+    must be the exact sum of the chunk sizes, method the name of the
+    called XML-RPC method.
+
+    """
+
+    def __init__(self, length, chunks, method):
+        """Initialize with the body length and the chunk function."""
+        self._length = length
+        self._chunks = chunks
+        self.method = method
+
+
+    def __len__(self):
+        """Return the body length."""
+        return self._length
+
+
+    def __iter__(self):
+        """Return a new iterator over the body chunks."""
+        return self._chunks()
+
+
+class StreamingUnmarshaller(xmlrpclib.Unmarshaller):
+    """Unmarshaller handing out the structs of an array response early.
+
+    Each struct that is a direct element of the response array is moved to
+    the records list as soon as its closing tag is parsed, instead of being
+    kept on the stack until the whole array is complete. Fault responses
+    and all other values are unmarshalled as usual.
+
+    """
+
+    def __init__(self, use_datetime=0):
+        """Initalize and call anchestor __init__()."""
+        xmlrpclib.Unmarshaller.__init__(self, use_datetime)
+        self.records = []
+
+
+    def end_struct(self, data):
+        """Build the struct and move it to records if it is an array element."""
+        xmlrpclib.Unmarshaller.end_struct(self, data)
+        # the only open mark is the one of the response array
+        if len(self._marks) == 1:
+            self.records.append(self._stack.pop())
+
+    dispatch = xmlrpclib.Unmarshaller.dispatch.copy()
+    dispatch['struct'] = end_struct
+
+
+class PersistentTransport(xmlrpclib.Transport):
+    """XML-RPC transport which keeps its HTTP connection alive.
+
+    The default transport of older Python versions opens a new connection
+    (and does a new TLS handshake) for every call. This one sends all
+    requests over one HTTP/1.1 connection. When the server has closed it
+    in the meantime, it reconnects and resends the request once.
+
+    With gzip=True responses are requested gzip compressed. Request bodies
+    of at least gzip_threshold bytes are sent gzip compressed as well (0
+    disables this). Not every server accepts compressed requests; if one
+    is rejected, it is resent uncompressed and request compression is
+    turned off.
+
+    The stats dictionary counts requests, opened connections, requests sent
+    over an already open connection and reconnects, and the bytes sent and
+    received, both on the wire and uncompressed (*_raw).
+
+    observer, if given, is called after every request as
+    observer(method, seconds, bytes_out, bytes_in, error) with the bytes
+    counted on the wire. Faults count as errors.
+
+    """
+
+    def __init__(self, use_https=False, use_datetime=0, gzip=True,
+                 gzip_threshold=0, observer=None):
+        """Initalize and call anchestor __init__()."""
+        xmlrpclib.Transport.__init__(self, use_datetime)
+        self._use_https = use_https
+        self._gzip = gzip
+        self._gzip_threshold = gzip_threshold
+        self._observer = observer
+        self._conn = None
+        self._conn_host = None
+        self.stats = { 'requests': 0,
+                       'connections': 0,
+                       'reused': 0,
+                       'reconnects': 0,
+                       'bytes_out': 0,
+                       'bytes_out_raw': 0,
+                       'bytes_in': 0,
+                       'bytes_in_raw': 0,
+                       'gzip_rejected': 0 }
+
+
+    def _get_connection(self, host):
+        """Return (connection, reused) for host."""
+        if self._conn is not None and self._conn_host == host:
+            return self._conn, True
+
+        self.close()
+        chost, self._extra_headers, x509 = self.get_host_info(host)
+        if self._use_https:
+            self._conn = httplib.HTTPSConnection(chost)
+        else:
+            self._conn = httplib.HTTPConnection(chost)
+        self._conn_host = host
+        self.stats['connections'] += 1
+        return self._conn, False
+
+
+    def close(self):
+        """Close the cached connection."""
+        if self._conn is not None:
+            self._conn.close()
+        self._conn = None
+        self._conn_host = None
+
+
+    def request(self, host, handler, request_body, verbose=0):
+        """Send a XML-RPC request and return the unmarshalled response.
+
+        request_body may be a StreamingBody, it is sent uncompressed.
+
+        """
+        observation = self._observe_start()
+        error = True
+        try:
+            result = self._request(host, handler, request_body)
+            error = False
+            return result
+        finally:
+            self._observe_end(observation, request_body, error)
+
+
+    def _request(self, host, handler, request_body):
+        """Send request_body, compressed if it is large enough."""
+        if self._gzip_threshold and len(request_body) >= self._gzip_threshold \
+                and isinstance(request_body, str):
+            try:
+                return self._retry(host, handler, request_body,
+                                   self._single_request, 'gzip')
+            except (xmlrpclib.ProtocolError, xmlrpclib.Fault), e:
+                # 400, 415 or a parse error: the server did not decode the
+                # body, so it is safe to send it again
+                if isinstance(e, xmlrpclib.Fault) and e.faultCode != -32700:
+                    raise
+                if isinstance(e, xmlrpclib.ProtocolError) \
+                        and e.errcode not in (400, 415):
+                    raise
+                self._gzip_threshold = 0
+                self.stats['gzip_rejected'] += 1
+        return self._retry(host, handler, request_body, self._single_request)
+
+
+    def _observe_start(self):
+        """Return the state needed by _observe_end()."""
+        if self._observer is None:
+            return None
+        return time.time(), self.stats['bytes_out'], self.stats['bytes_in']
+
+
+    def _observe_end(self, observation, request_body, error):
+        """Report a finished request to the observer."""
+        if observation is None:
+            return
+        start, bytes_out, bytes_in = observation
+        if isinstance(request_body, StreamingBody):
+            method = request_body.method
+        else:
+            start_tag = request_body.find('<methodName>', 0, 256)
+            end_tag = request_body.find('</methodName>', start_tag, 512)
+            method = request_body[start_tag + 12:end_tag] if start_tag >= 0 else '?'
+        self._observer(method, time.time() - start,
+                       self.stats['bytes_out'] - bytes_out,
+                       self.stats['bytes_in'] - bytes_in, error)
+
+
+    def _retry(self, host, handler, request_body, send, content_encoding=None):
+        """Run send(conn, host, handler, request_body, content_encoding)
+        and return its result."""
+        for attempt in (0, 1):
+            conn, reused = self._get_connection(host)
+            try:
+                result = send(conn, host, handler, request_body,
+                              content_encoding)
+            except RequestNotSent, e:
+                # the server may close idle connections, retry once on a
+                # fresh one
+                self.close()
+                if attempt or not reused:
+                    raise e.error
+                self.stats['reconnects'] += 1
+                continue
+            except (socket.error, httplib.HTTPException):
+                # the server may have run the request, sending it again
+                # could e.g. store a page twice
+                self.close()
+                raise
+            self.stats['requests'] += 1
+            if reused:
+                self.stats['reused'] += 1
+            return result
+
+
+    def _single_request(self, conn, host, handler, request_body,
+                        content_encoding=None):
+        """Send one request over conn."""
+        response = self._send_request(conn, host, handler, request_body,
+                                      content_encoding)
+        decoder = self._decoder(response)
+        data = decoder(response.read()) + decoder(None)
+        self._check_close(response)
+
+        parser, unmarshaller = self.getparser()
+        parser.feed(data)
+        parser.close()
+        return unmarshaller.close()
+
+
+    def _send_request(self, conn, host, handler, request_body,
+                      content_encoding=None):
+        """Send one request over conn and return the HTTP response.
+
+        Raises RequestNotSent if the connection was found closed while
+        sending or before any response byte, like xmlrpclib.Transport.
+
+        """
+        self.stats['bytes_out_raw'] += len(request_body)
+        if content_encoding == 'gzip':
+            compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            request_body = compressor.compress(request_body) + compressor.flush()
+        self.stats['bytes_out'] += len(request_body)
+
+        try:
+            self._send_body(conn, handler, request_body, content_encoding)
+        except socket.error, e:
+            if e.errno in (errno.ECONNRESET, errno.ECONNABORTED, errno.EPIPE):
+                raise RequestNotSent(e)
+            raise
+        try:
+            response = conn.getresponse()
+        except httplib.BadStatusLine, e:
+            if e.line == repr('') or e.line.startswith('No status line'):
+                raise RequestNotSent(e)
+            raise
+        if response.status != 200:
+            response.read()
+            self._check_close(response)
+            raise xmlrpclib.ProtocolError(host + handler, response.status,
+                                          response.reason, response.msg)
+        return response
+
+
+    def _send_body(self, conn, handler, request_body, content_encoding):
+        """Send the headers and request_body over conn."""
+        conn.putrequest('POST', handler, skip_accept_encoding=True)
+        conn.putheader('Content-Type', 'text/xml')
+        conn.putheader('User-Agent', self.user_agent)
+        conn.putheader('Content-Length', str(len(request_body)))
+        if content_encoding:
+            conn.putheader('Content-Encoding', content_encoding)
+        if self._gzip:
+            conn.putheader('Accept-Encoding', 'gzip')
+        extra_headers = self._extra_headers or []
+        if isinstance(extra_headers, dict):
+            extra_headers = extra_headers.items()
+        for key, value in extra_headers:
+            conn.putheader(key, value)
+        if isinstance(request_body, StreamingBody):
+            conn.endheaders()
+            try:
+                for chunk in request_body:
+                    conn.send(chunk)
+            except:
+                # the server still waits for the rest of the body
+                self.close()
+                raise
+        else:
+            # headers and body in one segment, a separate small send waits
+            # for the delayed ACK of the headers (Nagle)
+            conn.endheaders(request_body)
+
+
+    def _decoder(self, response):
+        """Return a function decoding the chunks of the response body.
+
+        It is called with each chunk as read from the connection and finally
+        with None, and returns the uncompressed data. It also counts the
+        received bytes.
+
+        """
+        if response.getheader('content-encoding', '').lower() == 'gzip':
+            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        else:
+            decompressor = None
+
+        def decode(data):
+            if data is None:
+                data = decompressor.flush() if decompressor else ''
+            else:
+                self.stats['bytes_in'] += len(data)
+                if decompressor:
+                    data = decompressor.decompress(data)
+            self.stats['bytes_in_raw'] += len(data)
+            return data
+        return decode
+
+
+    def _check_close(self, response):
+        """Drop the connection if the server is going to close it."""
+        if response.getheader('connection', '').lower() == 'close' \
+                or response.version < 11:
+            self.close()
+
+
+    def stream_request(self, host, handler, request_body, chunk_size=65536):
+        """Send a XML-RPC request and yield the records of its response.
+
+        The response must be an array of structs. The structs are yielded
+        one at a time while the response is downloaded and parsed, so the
+        complete list is never held in memory. A fault is raised as
+        xmlrpclib.Fault after the response is read.
+
+        """
+        observation = self._observe_start()
+        complete = False
+        error = True
+        try:
+            response = self._retry(host, handler, request_body,
+                                   self._send_request)
+            decoder = self._decoder(response)
+            unmarshaller = StreamingUnmarshaller(self._use_datetime)
+            parser = xmlrpclib.ExpatParser(unmarshaller)
+            while True:
+                data = response.read(chunk_size)
+                if not data:
+                    parser.feed(decoder(None))
+                    break
+                parser.feed(decoder(data))
+                records = unmarshaller.records
+                unmarshaller.records = []
+                for record in records:
+                    yield record
+            complete = True
+            self._check_close(response)
+            parser.close()
+            for record in unmarshaller.records:
+                yield record
+            unmarshaller.close()
+            error = False
+        finally:
+            # a partly read response leaves the connection unusable
+            if not complete:
+                self.close()
+            self._observe_end(observation, request_body, error)
+
+
 class DokuWikiClient(object):
     """DokuWiki XML-RPC client.
 
@@ -90,40 +478,50 @@ class DokuWikiClient(object):
                 
     """
 
-    def __init__(self, url, user, passwd, http_basic_auth=False):
+    def __init__(self, url, user, passwd, http_basic_auth=False,
+                 check_version=True, gzip=True, gzip_threshold=0,
+                 observer=None):
         """Initalize everything.
 
         Try to get a XML-RPC object. If this step fails a DokuWIKIXMLRPCError
         is raised. If the supplied URL is not reachable we raise a
         DokuWikiURLError. Use these to catch bad user input.
 
+        With check_version=False no request is made, dokuwiki_version stays
+        None and a bad URL only shows on the first call.
+
+        gzip and gzip_threshold control the compression of responses and
+        requests, observer is notified of every request, see
+        PersistentTransport.
+
         """
 
         self._url = url
         self._user = user
         self._passwd = passwd
         self._http_basic_auth = http_basic_auth
+        self._gzip = gzip
+        self._gzip_threshold = gzip_threshold
+        self._observer = observer
         self._user_agent = ' '.join([ 'DokuWikiXMLRPC ', 
                                       __version__,
                                       'by (www.chimeric.de)' ])
 
         self._xmlrpc = self._xmlrpc_init()
 
+        self.dokuwiki_version = None
+        if not check_version:
+            return
+
+        # the first call doubles as reachability check of the URL
         try:
             self.dokuwiki_version = self._dokuwiki_version()
-        except xmlrpclib.Fault, fault:
-            raise DokuWikiXMLRPCError(fault)
+        except (socket.error, httplib.HTTPException, xmlrpclib.ProtocolError):
+            raise DokuWikiURLError(self._url)
 
 
     def _xmlrpc_init(self):
         """Initialize the XMLRPC object."""
-        try:
-            urlopen(self._url + '/lib/exe/xmlrpc.php?')
-        except ValueError:
-            raise DokuWikiURLError(self._url)
-        except HTTPError:
-            raise DokuWikiURLError(self._url)
-        
         script = '/lib/exe/xmlrpc.php'
 
         if not self._http_basic_auth:
@@ -136,7 +534,35 @@ class DokuWikiClient(object):
         xmlrpclib.Transport.user_agent = self._user_agent
         xmlrpclib.SafeTransport.user_agent = self._user_agent
 
-        return xmlrpclib.ServerProxy(url)
+        self._transport = PersistentTransport(url.startswith('https://'),
+                                              gzip=self._gzip,
+                                              gzip_threshold=self._gzip_threshold,
+                                              observer=self._observer)
+        # like ServerProxy, for requests sent around it by _stream()
+        self._host, self._handler = urllib.splithost(urllib.splittype(url)[1])
+        if not self._handler:
+            self._handler = '/RPC2'
+        try:
+            return xmlrpclib.ServerProxy(url, transport=self._transport)
+        except (IOError, ValueError):
+            raise DokuWikiURLError(self._url)
+
+
+    def transport_stats(self):
+        """Return the connection statistics of the HTTP transport."""
+        return dict(self._transport.stats)
+
+
+    def _stream(self, method, params):
+        """Call method and yield the structs of its array response."""
+        request = xmlrpclib.dumps(params, method, allow_none=True)
+        try:
+            for record in self._transport.stream_request(self._host,
+                                                         self._handler,
+                                                         request):
+                yield record
+        except xmlrpclib.Fault, fault:
+            raise DokuWikiXMLRPCError(fault)
 
 
     def _dokuwiki_version(self):
@@ -229,15 +655,21 @@ class DokuWikiClient(object):
         except xmlrpclib.Fault, fault:
             raise DokuWikiXMLRPCError(fault)
 
-    def pagelist(self, namespace):
+    def pagelist(self, namespace, options=None):
         """
         Lists all pages within a given namespace. 
+
+        options are passed on to dokuwiki.getPagelist, e.g. {'depth': 2}
         """
         try:
-            return self._xmlrpc.dokuwiki.getPagelist(namespace, {})
+            return self._xmlrpc.dokuwiki.getPagelist(namespace, options or {})
         except xmlrpclib.Fault, fault:
             raise DokuWikiXMLRPCError(fault)
 
+    def iter_pagelist(self, namespace, options=None):
+        """Like pagelist(), but yield the pages while they are received."""
+        return self._stream('dokuwiki.getPagelist', (namespace, options or {}))
+
     def all_pages(self):
         """List all pages of the remote Wiki."""
         try:
@@ -245,6 +677,10 @@ class DokuWikiClient(object):
         except xmlrpclib.Fault, fault:
             raise DokuWikiXMLRPCError(fault)
 
+    def iter_all_pages(self):
+        """Like all_pages(), but yield the pages while they are received."""
+        return self._stream('wiki.getAllPages', ())
+
 
     def backlinks(self, page_id):
         """Return a list of pages that link back to a Wiki page."""
@@ -269,6 +705,13 @@ class DokuWikiClient(object):
         except xmlrpclib.Fault, fault:
             raise DokuWikiXMLRPCError(fault)
 
+    def recent_media_changes(self, timestamp):
+        """Return the recent media changes since a given timestampe (UTC)."""
+        try:
+            return self._xmlrpc.wiki.getRecentMediaChanges(timestamp)
+        except xmlrpclib.Fault, fault:
+            raise DokuWikiXMLRPCError(fault)
+
 
     def acl_check(self, page_id):
         """Return the permissions of a Wiki page."""
@@ -280,7 +723,7 @@ class DokuWikiClient(object):
     def get_file(self, file_id):
         """Download a file from a remote Wiki."""
         try:
-            return base64.b64decode(self._xmlrpc.wiki.getAttachment(file_id))
+            return _decode_file(self._xmlrpc.wiki.getAttachment(file_id))
         except xmlrpclib.Fault, fault:
             raise DokuWikiXMLRPCError(fault)
 
@@ -292,6 +735,46 @@ class DokuWikiClient(object):
         except xmlrpclib.Fault, fault:
             raise DokuWikiXMLRPCError(fault)
 
+    def put_file_stream(self, file_id, fileobj, size, overwrite=False):
+        """Upload size bytes read from fileobj to a remote Wiki.
+
+        Unlike put_file() the data is never held in memory as a whole: it is
+        read from the start of fileobj and base64 encoded chunk by chunk
+        while the request is sent.
+
+        """
+        marker = '__put_file_stream_data__'
+        head, tail = xmlrpclib.dumps((file_id, marker, {'ow': overwrite}),
+                                     'wiki.putAttachment').split(marker)
+        # whole groups of three bytes encode without padding
+        chunk_size = 3 * 64 * 1024
+
+        def chunks():
+            fileobj.seek(0)
+            yield head
+            remaining = size
+            pending = ''
+            while remaining > 0:
+                data = fileobj.read(min(chunk_size, remaining))
+                if not data:
+                    raise IOError('%s: file shorter than %d bytes'
+                                  % (file_id, size))
+                remaining -= len(data)
+                data = pending + data
+                # keep a short read's incomplete group for the next chunk
+                cut = len(data) - len(data) % 3 if remaining else len(data)
+                pending = data[cut:]
+                yield base64.b64encode(data[:cut])
+            yield tail
+
+        body = StreamingBody(len(head) + 4 * ((size + 2) // 3) + len(tail),
+                             chunks, 'wiki.putAttachment')
+        try:
+            return self._transport.request(self._host, self._handler,
+                                           body)[0]
+        except xmlrpclib.Fault, fault:
+            raise DokuWikiXMLRPCError(fault)
+
     def delete_file(self, file_id):
         """Delete a file from a remote wiki."""
         try:
@@ -332,6 +815,254 @@ class DokuWikiClient(object):
             raise DokuWikiXMLRPCError(fault)
 
 
+    def multicall(self, calls):
+        """Send a list of (method name, params) pairs in one request.
+
+        Returns the raw system.multicall result: a one element list per
+        successful call and a fault struct per failed one. See batch() for a
+        friendlier interface.
+
+        """
+        try:
+            return self._xmlrpc.system.multicall(
+                [ {'methodName': method, 'params': list(params)}
+                  for method, params in calls ])
+        except xmlrpclib.Fault, fault:
+            raise DokuWikiXMLRPCError(fault)
+
+
+    def batch(self):
+        """Return a DokuWikiBatch collecting calls for one multicall."""
+        return DokuWikiBatch(self)
+
+
+class DokuWikiBatch(object):
+    """Batch of XML-RPC calls sent in one system.multicall request.
+
+    The methods take the same arguments as their DokuWikiClient counterparts
+    but only queue the call. execute() sends the queue and returns the results
+    in call order. A call the server answered with a fault is returned as
+    DokuWikiXMLRPCError instance instead of being raised, so one missing page
+    does not spoil the results of the others.
+
+    """
+
+    def __init__(self, client):
+        """Initialize an empty batch for client (or a DokuWikiClientPool)."""
+        self._client = client
+        self._calls = []
+
+
+    def __len__(self):
+        """Return the number of queued calls."""
+        return len(self._calls)
+
+
+    def _queue(self, method, params, convert=None):
+        """Queue a call, convert is applied to its result."""
+        self._calls.append((method, params, convert))
+
+
+    def dokuwiki_version(self):
+        """Queue the dokuwiki.getVersion call done by DokuWikiClient()."""
+        self._queue('dokuwiki.getVersion', ())
+
+
+    def rpc_version_supported(self):
+        """Queue DokuWikiClient.rpc_version_supported()."""
+        self._queue('wiki.getRPCVersionSupported', ())
+
+
+    def page(self, page_id, revision=None):
+        """Queue DokuWikiClient.page()."""
+        if not revision:
+            self._queue('wiki.getPage', (page_id,))
+        else:
+            self._queue('wiki.getPageVersion', (page_id, revision))
+
+
+    def page_info(self, page_id, revision=None):
+        """Queue DokuWikiClient.page_info()."""
+        if not revision:
+            self._queue('wiki.getPageInfo', (page_id,))
+        else:
+            self._queue('wiki.getPageInfoVersion', (page_id, revision))
+
+
+    def page_html(self, page_id, revision=None):
+        """Queue DokuWikiClient.page_html()."""
+        if not revision:
+            self._queue('wiki.getPageHTML', (page_id,))
+        else:
+            self._queue('wiki.getPageHTMLVersion', (page_id, revision))
+
+
+    def page_versions(self, page_id, offset=0):
+        """Queue DokuWikiClient.page_versions()."""
+        self._queue('wiki.getPageVersions', (page_id, offset))
+
+
+    def pagelist(self, namespace, options=None):
+        """Queue DokuWikiClient.pagelist()."""
+        self._queue('dokuwiki.getPagelist', (namespace, options or {}))
+
+
+    def list_files(self, namespace, recursive=False, pattern=None):
+        """Queue DokuWikiClient.list_files()."""
+        options = {}
+        if recursive:
+            options['recursive'] = True
+        if pattern:
+            options['pattern'] = pattern
+        self._queue('wiki.getAttachments', (namespace, options))
+
+
+    def acl_check(self, page_id):
+        """Queue DokuWikiClient.acl_check()."""
+        self._queue('wiki.aclCheck', (page_id,))
+
+
+    def get_file(self, file_id):
+        """Queue DokuWikiClient.get_file()."""
+        self._queue('wiki.getAttachment', (file_id,), _decode_file)
+
+
+    def file_info(self, file_id):
+        """Queue DokuWikiClient.file_info()."""
+        self._queue('wiki.getAttachmentInfo', (file_id,))
+
+
+    def set_locks(self, locks):
+        """Queue DokuWikiClient.set_locks()."""
+        self._queue('dokuwiki.setLocks', (locks,))
+
+
+    def execute(self):
+        """Send all queued calls and return their results.
+
+        Raises DokuWikiXMLRPCError only if the multicall itself fails.
+
+        """
+        calls, self._calls = self._calls, []
+        if not calls:
+            return []
+
+        results = self._client.multicall(
+            [ (method, params) for method, params, convert in calls ])
+
+        values = []
+        for (method, params, convert), result in zip(calls, results):
+            if isinstance(result, dict):
+                values.append(DokuWikiXMLRPCError(
+                    xmlrpclib.Fault(result['faultCode'], result['faultString'])))
+            elif convert:
+                values.append(convert(result[0]))
+            else:
+                values.append(result[0])
+        return values
+
+
+class DokuWikiClientPool(object):
+    """Thread-safe pool of DokuWikiClient instances.
+
+    A xmlrpclib.ServerProxy must not be used by two threads at once. The pool
+    offers the same methods as DokuWikiClient, but runs every call on a
+    client of its own. Up to size clients are created on demand; further
+    callers wait until a client is returned. The iter_* methods keep their
+    client until the iteration is finished or the generator is closed.
+
+    """
+
+    def __init__(self, size, *args, **kwargs):
+        """Initialize the pool and create the first client.
+
+        The remaining arguments are passed on to DokuWikiClient. Creating
+        the first client right away raises the same errors as creating a
+        DokuWikiClient would.
+
+        """
+        self._size = max(1, size)
+        self._args = args
+        self._kwargs = kwargs
+        self._condition = threading.Condition()
+        self._idle = [ DokuWikiClient(*args, **kwargs) ]
+        self._clients = list(self._idle)
+        self._created = 1
+        self.dokuwiki_version = self._idle[0].dokuwiki_version
+
+
+    def acquire(self):
+        """Check out a client, creating one if the pool is not exhausted."""
+        self._condition.acquire()
+        try:
+            while not self._idle and self._created >= self._size:
+                self._condition.wait()
+            if self._idle:
+                return self._idle.pop()
+            self._created += 1
+        finally:
+            self._condition.release()
+
+        try:
+            client = DokuWikiClient(*self._args, **self._kwargs)
+        except:
+            self._condition.acquire()
+            self._created -= 1
+            self._condition.notify()
+            self._condition.release()
+            raise
+        self._clients.append(client)
+        return client
+
+
+    def release(self, client):
+        """Return a client checked out with acquire()."""
+        self._condition.acquire()
+        self._idle.append(client)
+        self._condition.notify()
+        self._condition.release()
+
+
+    def batch(self):
+        """Return a DokuWikiBatch executed on a pooled client."""
+        return DokuWikiBatch(self)
+
+
+    def transport_stats(self):
+        """Return the connection statistics summed over all clients."""
+        stats = {}
+        for client in list(self._clients):
+            for key, value in client.transport_stats().items():
+                stats[key] = stats.get(key, 0) + value
+        return stats
+
+
+    def __getattr__(self, name):
+        """Proxy DokuWikiClient methods through a pooled client."""
+        if name.startswith('_') or not callable(getattr(DokuWikiClient, name, None)):
+            raise AttributeError(name)
+
+        def call(*args, **kwargs):
+            client = self.acquire()
+            try:
+                return getattr(client, name)(*args, **kwargs)
+            finally:
+                self.release(client)
+
+        def iterate(*args, **kwargs):
+            client = self.acquire()
+            try:
+                for item in getattr(client, name)(*args, **kwargs):
+                    yield item
+            finally:
+                self.release(client)
+
+        if name.startswith('iter_'):
+            call = iterate
+        call.__name__ = name
+        return call
+
+
 class Callback(object):
     """Callback class used by the option parser.
 